@@ -9,6 +9,7 @@ import sys
 import os
 import heapq
 import queue
+from collections import deque
 import numpy as np
 import simplegraphs as sg
 
@@ -21,7 +22,163 @@ import simplegraphs as sg
 ############################################################
 
 
-def bellmanFordSimple(G, s):
+def findParentCycle(parent, nodes):
+    # Verify that there is a cycle in the parent pointers the algorithm
+    # is maintaining, by walking up from each of the given nodes (the
+    # ones that changed). Returns the nodes of the cycle in order, or []
+    # if there is none.
+    verify = set(nodes) # the list of changed nodes
+
+    while len(verify):
+        current_cycle = set() # init set of nodes in cycle
+        current_node = verify.pop() # get a node from list of nodes to verify
+
+        while current_node is not None and current_node not in current_cycle:
+            current_cycle.add(current_node) # add node to cycle
+
+            # remove from our list of nodes to verify
+            if current_node in verify:
+                verify.remove(current_node)
+
+            current_node = parent[current_node] # go to next node
+
+        if current_node in current_cycle:
+            cycle_list = [] # initialize cycle list
+
+            # add all nodes in cycle
+            while current_node in current_cycle:
+                cycle_list.append(current_node)
+                current_cycle.remove(current_node)
+
+                current_node = parent[current_node] # go to parent of node
+
+            cycle_list.reverse()
+            return cycle_list
+
+    return [] # handle case in which cycle doesn't exist
+
+def sourceNodes(G, s):
+    # The nodes a Bellman-Ford run starts from, at distance 0. Normally
+    # this is just s. If s is None, it is every node of G: the state the
+    # algorithm would reach after one round if an extra source node had
+    # a zero-weight edge to every node, which is what negative cycle
+    # detection needs, without building that bigger graph.
+    if s is None:
+        return list(G["adj"])
+    return [s]
+
+def parentForest(roots):
+    # Keeps the parent pointers of a Bellman-Ford run as a forest, so
+    # that a cycle is noticed the moment a relaxation would create one.
+    # The forest is stored as a preorder "thread": a circular doubly
+    # linked list of its nodes (F["next"], F["prev"], with None as the
+    # head of the list) in which every subtree is a contiguous run of
+    # nodes deeper than its root, plus the depth of each node.
+    F = {"next": {None: None}, "prev": {None: None}, "depth": {}, "cycle": []}
+    for r in roots:
+        last = F["prev"][None]
+        F["next"][last] = r
+        F["prev"][r] = last
+        F["next"][r] = None
+        F["prev"][None] = r
+        F["depth"][r] = 0
+    return F
+
+def forestSetParent(F, parent, v, u):
+    # Makes u the parent of v in the forest F (subtree disassembly, as
+    # in Tarjan's version of Bellman-Ford). v's subtree is scanned to
+    # make sure it does not contain u and then moved, as one run of the
+    # thread, under u. This costs O(size of v's subtree).
+    # Returns the list of v's descendants. If u is v or one of its
+    # descendants, the new pointer would close a cycle, which must be
+    # negative; the forest is left alone, the cycle (in the order
+    # findParentCycle uses) is stored in F["cycle"] and None is returned.
+    nxt = F["next"]
+    prv = F["prev"]
+    depth = F["depth"]
+    if v not in depth: # v is new to the forest, so it has no subtree
+        b = nxt[u]
+        nxt[u] = v
+        prv[v] = u
+        nxt[v] = b
+        prv[b] = v
+        depth[v] = depth[u] + 1
+        return []
+    subtree = []
+    closes_cycle = u == v
+    x = nxt[v]
+    while x is not None and depth[x] > depth[v]:
+        subtree.append(x)
+        if x == u:
+            closes_cycle = True
+        x = nxt[x]
+    if closes_cycle:
+        cycle_list = [u]
+        while cycle_list[-1] != v:
+            cycle_list.append(parent[cycle_list[-1]])
+        cycle_list.reverse()
+        F["cycle"] = cycle_list
+        return None
+    # cut the run [v, ..., last] out of the thread...
+    last = subtree[-1] if subtree else v
+    a = prv[v]
+    b = nxt[last]
+    nxt[a] = b
+    prv[b] = a
+    # ...and splice it back in right after u
+    b = nxt[u]
+    nxt[u] = v
+    prv[v] = u
+    nxt[last] = b
+    prv[b] = last
+    delta = depth[u] + 1 - depth[v]
+    depth[v] += delta
+    for x in subtree:
+        depth[x] += delta
+    return subtree
+
+def relaxInPlace(G, d, parent, order, pos, F = None):
+    # One round of Bellman-Ford that updates the distances in d in place,
+    # using Yen's ordering: first the nodes in the given order relax
+    # their "forward" edges (to nodes at the same or a later position),
+    # then the nodes in reverse order relax their "backward" edges. A
+    # path that switches direction k times is found in about k/2 rounds.
+    # If a parent forest F is given, it is kept up to date and the round
+    # stops as soon as a cycle is found (see forestSetParent).
+    # Returns a dict of the nodes whose distance changed.
+    changed = {}
+    for backward in (False, True):
+        for u in (reversed(order) if backward else order):
+            for v in G["adj"][u]:
+                if (pos[v] < pos[u]) != backward:
+                    continue
+                newlength = d[u] + G["adj"][u][v]
+                if newlength < d[v]:
+                    changed[v] = True
+                    if F is not None and forestSetParent(F, parent, v, u) is None:
+                        return changed
+                    d[v] = newlength
+                    parent[v] = u
+    return changed
+
+def relaxRound(G, prev, d, parent, F = None):
+    # One round of Bellman-Ford: relaxes every edge using the distances
+    # prev from the previous round, and writes the new distances to d.
+    # F is used as in relaxInPlace. Returns a dict of the nodes whose
+    # distance changed.
+    changed = {}
+    for u in G["adj"]:
+        for v in G["adj"][u]:
+            newlength = prev[u] + G["adj"][u][v]
+            if newlength < d[v]:
+                changed[v] = True
+                if F is not None and forestSetParent(F, parent, v, u) is None:
+                    return changed
+                d[v] = newlength
+                parent[v] = u
+    return changed
+
+def bellmanFordSimple(G, s, inplace = False):
     # G is a dictionary with keys "n", "m", "adj" representing an *weighted* graph
     # G["adj"][u][v] is the cost (length / weight) of edge (u,v)
     # This algorithms finds least-costs paths to all vertices
@@ -31,25 +188,29 @@ def bellmanFordSimple(G, s):
     # This is basically the algorithm we covered in class (except it
     # finds paths from a source instead of to a desitnation).
     #
+    # Only the distances from the previous round are kept around, so
+    # memory is O(n) instead of O(n^2). If inplace is True, a single
+    # dict of distances is updated in place (see relaxInPlace).
+    #
     n = G["n"]
-    d = [{} for i in range(n)]
+    d = {}
     for u in G["adj"]:
-        d[0][u] = np.inf
-    d[0][s] = 0
+        d[u] = np.inf
+    d[s] = 0
     parent = {s: None}
+    order = list(G["adj"])
+    pos = {u: i for i, u in enumerate(order)}
     for i in range(1,n):
-        for v in G["adj"]:
-            d[i][v] = d[i-1][v]
-        for u in G["adj"]:
-            for v in G["adj"][u]:
-                newlength = d[i-1][u] + G["adj"][u][v]
-                if newlength <  d[i][v]:
-                    d[i][v] = newlength
-                    parent[v] = u
-    distances = d[n-1]
+        if inplace:
+            relaxInPlace(G, d, parent, order, pos)
+        else:
+            prev = d
+            d = dict(prev)
+            relaxRound(G, prev, d, parent)
+    distances = d
     return distances, parent
 
-def bellmanFordEarlyStop(G, s):
+def bellmanFordEarlyStop(G, s, inplace = False, incremental = False):
     # G is a dictionary with keys "n", "m", "adj" representing an *weighted* graph
     # G["adj"][u][v] is the cost (length / weight) of edge (u,v)
     # This algorithms finds least-costs paths to all vertices
@@ -57,91 +218,260 @@ def bellmanFordEarlyStop(G, s):
     #
     # This version stops early when no further changes observed. 
     #
-
-    # SET ALL DISTANCES TO INF
+    # As in bellmanFordSimple, only the previous round's distances are
+    # kept, and inplace = True updates a single dict of distances.
+    #
+    # By default, the parent pointers are checked for a cycle after each
+    # round (see findParentCycle). If incremental is True, they are kept
+    # in a parent forest instead, and the run stops at the relaxation
+    # that would close a cycle (see forestSetParent).
+    #
+    # If s is None, every node starts at distance 0 (see sourceNodes).
+    #
 
     n = G["n"]
 
     # init all distances to infinite
-    d = [{} for _ in range(n+1)]
-
+    d = {}
     for u in G["adj"]:
-        d[0][u] = float('inf')  
-
-    d[0][s] = 0
-    parent = {s: None}
+        d[u] = float('inf')  
+
+    roots = sourceNodes(G, s)
+    parent = {}
+    for r in roots:
+        d[r] = 0
+        parent[r] = None
+    order = list(G["adj"])
+    pos = {u: i for i, u in enumerate(order)}
+    F = parentForest(roots) if incremental else None
+    cycle_list = []
+    i = 0 # rounds done; stays 0 for an empty graph
+    changed = {}
 
-    # verify that there is a cycle in the parent points algo is maintaining
-    def verifyCycle():
-        verify = set(changed.keys()) # the list of changed nodes
-
-        while len(verify):
-            current_cycle = set() # init set of nodes in cycle
-            current_node = verify.pop() # get a node from list of nodes to verify
-
-            while current_node is not None and current_node not in current_cycle:
-                current_cycle.add(current_node) # add node to cycle
-
-                # remove from our list of nodes to verify
-                if current_node in verify:
-                    verify.remove(current_node)
-
-                current_node = parent[current_node] # go to next node
+    for i in range(1, n+1):
+        if inplace:
+            changed = relaxInPlace(G, d, parent, order, pos, F)
+        else:
+            prev = d
+            d = dict(prev)
+            changed = relaxRound(G, prev, d, parent, F)
 
-            if current_node in current_cycle:
-                cycle_list = [] # initialize cycle list
+        # there are no negative cycles, we can break early
+        if not changed:
+            break
 
-                # add all nodes in cycle
-                while current_node in current_cycle:
-                    cycle_list.append(current_node)
-                    current_cycle.remove(current_node)
+        # stop early if there is a cycle in the parents
+        if incremental:
+            cycle_list = F["cycle"]
+        else:
+            cycle_list = findParentCycle(parent, changed)
+        if len(cycle_list):
+            break
 
-                    current_node = parent[current_node] # go to parent of node
+    # if the last iteration had distances still changing,
+    # there must exist a negative weight cycle reachable from s.
+    distances = d
 
-                cycle_list.reverse()
-                return cycle_list
+    return distances, parent, i, bool(changed), cycle_list
 
-        return [] # handle case in which cycle doesn't exist
+def bellmanFordQueue(G, s, incremental = False):
+    # G is a dictionary with keys "n", "m", "adj" representing an *weighted* graph
+    # G["adj"][u][v] is the cost (length / weight) of edge (u,v)
+    # This algorithms finds least-costs paths to all vertices
+    # Returns the same values as bellmanFordEarlyStop.
+    #
+    # This version (sometimes called SPFA) keeps a single dict of
+    # distances and a queue of the nodes whose distance changed. Only the
+    # out-edges of those nodes are relaxed. Each round processes the
+    # nodes that were queued during the previous round, so round i finds
+    # every path that uses at most i edges, as in bellmanFordEarlyStop.
+    #
+    # If incremental is True, the parent pointers are kept in a parent
+    # forest, as in bellmanFordEarlyStop. This is Tarjan's subtree
+    # disassembly: when a node's distance drops, its descendants are
+    # skipped if they come up in the queue, since their distances are
+    # now out of date and will drop too once the change reaches them.
+    #
+    # If s is None, every node starts at distance 0 (see sourceNodes).
+    #
+    n = G["n"]
 
-    for i in range(1, n+1):
+    d = {}
+    for u in G["adj"]:
+        d[u] = float('inf')
+    roots = sourceNodes(G, s)
+    parent = {}
+    for r in roots:
+        d[r] = 0
+        parent[r] = None
+    F = parentForest(roots) if incremental else None
+    stale = set() # descendants of nodes whose distance dropped
+
+    Q = deque(roots) # nodes whose out-edges need to be relaxed
+    in_queue = set(roots)
+    cycle_list = []
+    i = 0
+
+    while Q and i < n and not cycle_list:
+        i += 1
         changed = {}
-        for v in G["adj"]:
-            d[i][v] = d[i-1][v]
-        for u in G["adj"]:
+        for _ in range(len(Q)): # the nodes queued in the previous round
+            u = Q.popleft()
+            in_queue.remove(u)
+            if u in stale:
+                stale.remove(u)
+                continue
             for v in G["adj"][u]:
-                newlength = d[i-1][u] + G["adj"][u][v]
-                if newlength < d[i][v]:
-                    d[i][v] = newlength
+                newlength = d[u] + G["adj"][u][v]
+                if newlength < d[v]:
+                    if incremental:
+                        subtree = forestSetParent(F, parent, v, u)
+                        if subtree is None:
+                            cycle_list = F["cycle"]
+                            break
+                        stale.update(subtree)
+                        stale.discard(v)
+                    d[v] = newlength
                     parent[v] = u
                     changed[v] = True
+                    if v not in in_queue:
+                        Q.append(v)
+                        in_queue.add(v)
+            if cycle_list:
+                break
+
+        # stop early if there is a cycle in the parents
+        if not incremental:
+            cycle_list = findParentCycle(parent, changed)
+
+    # if nodes are still waiting to be relaxed after the last round,
+    # there must exist a negative weight cycle reachable from s.
+    return d, parent, i, bool(Q) or bool(cycle_list), cycle_list
+
+def findParentCycleArray(par):
+    # Array version of findParentCycle. par[u] is the index of u's
+    # parent, or -1 if u has none. Returns the indices of the nodes on a
+    # cycle of parent pointers, in order, or [] if there is none.
+    n = len(par)
+    jump = np.append(par, n) # node n is a sink standing in for "no parent"
+    jump[jump < 0] = n
+    # after 2^k >= n jumps every node has reached the sink or a cycle
+    steps = 1
+    while steps < n:
+        jump = jump[jump]
+        steps *= 2
+    on_cycle = np.flatnonzero(jump[:n] < n)
+    if len(on_cycle) == 0:
+        return []
+    start = int(jump[on_cycle[0]])
+    cycle_list = [start]
+    current_node = int(par[start])
+    while current_node != start:
+        cycle_list.append(current_node)
+        current_node = int(par[current_node])
+    cycle_list.reverse()
+    return cycle_list
+
+def bellmanFordArrays(G, s):
+    # G is a dictionary with keys "n", "m", "adj" representing an *weighted* graph
+    # G["adj"][u][v] is the cost (length / weight) of edge (u,v)
+    # This algorithms finds least-costs paths to all vertices
+    # Returns the same values as bellmanFordEarlyStop.
+    #
+    # This version stores the edges as NumPy arrays src, dst, w, sorted
+    # by dst, and does each round with a few vectorized operations: a
+    # minimum over each node's incoming edges (np.minimum.reduceat),
+    # then a lookup of the edge that achieved it to set the parent.
+    #
+    # If s is None, every node starts at distance 0 (see sourceNodes).
+    #
+    n = G["n"]
+    C = sg.toCSR(G)
+    src = np.repeat(np.arange(C["n"]), np.diff(C["indptr"]))
+    order = np.argsort(C["indices"], kind="stable")
+    src = src[order]
+    dst = C["indices"][order].astype(np.int64)
+    w = C["weights"][order]
+    targets, starts = np.unique(dst, return_index=True)
+    group = np.repeat(np.arange(len(targets)), np.diff(np.append(starts, len(dst))))
+
+    d = np.full(C["n"], np.inf)
+    if s is None:
+        d[:] = 0
+    else:
+        d[sg.csrIndex(C)[s]] = 0
+    par = np.full(C["n"], -1, dtype=np.int64)
+    changed = np.zeros(0, dtype=np.int64)
+    cycle_list = []
+    i = 0 # rounds done; stays 0 for an empty graph
+
+    for i in range(1, n+1):
+        if len(dst) == 0:
+            break
+        newlength = d[src] + w
+        best = np.minimum.reduceat(newlength, starts)
+        improved = best < d[targets]
+        changed = targets[improved]
 
         # there are no negative cycles, we can break early
-        if not changed:
+        if len(changed) == 0:
             break
 
+        # parent of each improved node: an edge that achieved the minimum
+        wins = np.flatnonzero(improved[group] & (newlength == best[group]))
+        par[dst[wins]] = src[wins]
+        d[changed] = best[improved]
+
         # stop early if there is a cycle in the parents
-        cycle_list = verifyCycle()
+        cycle_list = findParentCycleArray(par)
         if len(cycle_list):
             break
 
+    nodes = C["nodes"].tolist()
+    distances = dict(zip(nodes, d.tolist()))
+    parent = {r: None for r in sourceNodes(G, s)}
+    for v in np.flatnonzero(par >= 0).tolist():
+        parent[nodes[v]] = nodes[par[v]]
+    cycle_list = [nodes[v] for v in cycle_list]
+
     # if the last iteration had distances still changing,
     # there must exist a negative weight cycle reachable from s.
-    distances = d[-1]
-
-    return distances, parent, i, bool(changed), cycle_list
-
-def negCycle(G):
-    # Make a copy of G. Don't touch G again
-    newG = sg.copyGraph(G)
-    
-    sg.addNode(newG, "s") 
-
-    for V in newG["adj"].keys():
-        if V != "s":
-            sg.addDirEdge(newG, "s", V, 0)
+    return distances, parent, i, bool(len(changed)), cycle_list
+
+def negCycle(G, method = "rounds", incremental = False, scc = False):
+    # method selects the Bellman-Ford variant that does the work:
+    # "rounds" for bellmanFordEarlyStop, "inplace" for
+    # bellmanFordEarlyStop with in-place updates, "queue" for
+    # bellmanFordQueue, "numpy" for bellmanFordArrays.
+    # incremental is passed on to the first three (see
+    # bellmanFordEarlyStop).
+    # If scc is True, each strongly connected component that can hold
+    # a cycle is searched on its own (see sg.cyclicComponents), stopping
+    # at the first negative cycle. Unless G is strongly connected, the
+    # components are copies of parts of G, so G is no longer used as is
+    # and memory use can double.
+
+    if scc:
+        for H in sg.cyclicComponents(G):
+            is_neg_cycle, cycle_list = negCycle(H, method, incremental)
+            if is_neg_cycle:
+                return is_neg_cycle, cycle_list
+        return False, []
+
+    # Start from every node at distance 0 (a virtual source; see
+    # sourceNodes), so G is used as is and never copied.
 
     # find negative cycles
-    distances, parent, i, is_neg_cycle, cycle_list = bellmanFordEarlyStop(newG, "s")
+    if method == "rounds":
+        distances, parent, i, is_neg_cycle, cycle_list = bellmanFordEarlyStop(G, None, incremental = incremental)
+    elif method == "inplace":
+        distances, parent, i, is_neg_cycle, cycle_list = bellmanFordEarlyStop(G, None, inplace = True, incremental = incremental)
+    elif method == "queue":
+        distances, parent, i, is_neg_cycle, cycle_list = bellmanFordQueue(G, None, incremental = incremental)
+    elif method == "numpy":
+        distances, parent, i, is_neg_cycle, cycle_list = bellmanFordArrays(G, None)
+    else:
+        raise ValueError("Unknown method {}".format(method))
 
     return is_neg_cycle, cycle_list # return result
 
@@ -152,7 +482,172 @@ def negCycle(G):
 ############################################################
 
 
-def BFCountSumPaths(G, s, k = None):
+def pathOperator(G):
+    # Prepares G for pathStep: the transpose of its adjacency matrix, as
+    # edge arrays sorted by head (src, w) and the position where each
+    # head's run of edges starts (heads, starts). Node i is the i-th
+    # node of G["adj"].
+    C = sg.toCSR(G)
+    src = np.repeat(np.arange(C["n"]), np.diff(C["indptr"]))
+    order = np.argsort(C["indices"], kind="stable")
+    heads, starts = np.unique(C["indices"][order], return_index=True)
+    P = {"n": C["n"],
+         "index": sg.csrIndex(C),
+         "src": src[order],
+         "w": C["weights"][order],
+         "heads": heads,
+         "starts": starts,
+         "max_in": int(np.diff(np.append(starts, C["m"])).max(initial=0))}
+    return P
+
+def spmv(P, x, weighted = False, modulus = None):
+    # Sparse matrix-vector product: returns y with y[v] equal to the sum
+    # of x[u] over the edges (u,v), each term multiplied by the weight
+    # of its edge if weighted is True. x can also be a block with one
+    # column per source, in which case every column is multiplied at
+    # once. If modulus is given, each term is reduced modulo it before
+    # the terms are added up.
+    #
+    # The edges are processed in runs of whole heads small enough that
+    # the gathered terms (about 1MB) stay in cache, which is several
+    # times faster than gathering x for all m edges at once.
+    src = P["src"]
+    heads = P["heads"]
+    starts = P["starts"]
+    width = 1 if x.ndim == 1 else x.shape[1]
+    dtype = np.result_type(x, P["w"]) if weighted else x.dtype
+    y = np.zeros(x.shape, dtype=dtype)
+    budget = max(1, (1 << 17) // width) # edges per run
+    cuts = np.unique(np.append(np.searchsorted(starts, np.arange(0, len(src), budget)), len(starts)))
+    for a, b in zip(cuts[:-1].tolist(), cuts[1:].tolist()):
+        lo = starts[a]
+        hi = starts[b] if b < len(starts) else len(src)
+        terms = x[src[lo:hi]]
+        if weighted:
+            terms = terms * (P["w"][lo:hi] if x.ndim == 1 else P["w"][lo:hi, None])
+        if modulus is not None:
+            terms %= modulus
+        y[heads[a:b]] = np.add.reduceat(terms, starts[a:b] - lo, axis=0)
+    return y
+
+def pathStep(P, count, weightsum, modulus = None):
+    # Extends all the paths by one edge: the paths with i edges to v are
+    # the paths with i-1 edges to some u followed by the edge (u,v).
+    # modulus is as in spmv.
+    return spmv(P, count), spmv(P, weightsum) + spmv(P, count, weighted = True, modulus = modulus)
+
+def checkOverflow(P, count):
+    # Raises OverflowError if the next pathStep could push an int64 path
+    # count past 2^63. The quick bound (largest count times largest
+    # in-degree) is usually enough. When it is not, the next counts are
+    # computed in floats to check for real.
+    if count.size == 0 or int(count.max()) * P["max_in"] < 2**63:
+        return
+    if spmv(P, count.astype(np.float64)).max() >= 2.0**63 * (1 - 1e-9):
+        raise OverflowError("Path counts no longer fit in int64; use counts = \"exact\", \"log\" or \"mod\".")
+
+def pathCountsAndSums(G, sources, k, all_steps = False, counts = "int64", modulus = 2**31 - 1):
+    # Matrix version of BFCountSumPaths for a batch of sources at once.
+    # Returns two arrays of shape (n, len(sources)): count[u, j] is the
+    # number of paths with exactly k edges from sources[j] to u, and
+    # weightsum[u, j] the sum of their costs. Rows follow the order of
+    # G["adj"]. If all_steps is True, returns the list of these pairs
+    # for 0,...,k edges instead.
+    #
+    # The number of paths grows exponentially with k, so counts selects
+    # how they are represented:
+    #   "int64": NumPy int64, raising OverflowError rather than wrapping
+    #       around (see checkOverflow). Weight sums are floats.
+    #   "exact": Python ints in object arrays, never overflowing. Weight
+    #       sums are exact too if every weight is an integer.
+    #   "log": floats rescaled after each step so the largest count of
+    #       each source is 1, with the log of the scale kept apart. count
+    #       then holds the natural log of each count (-inf for none), and
+    #       weightsum holds weightsum / count (0 for none), since the sums
+    #       themselves would overflow.
+    #   "mod": int64 counts and weight sums modulo modulus (a number
+    #       below 2^31). Needs integer weights.
+    P = pathOperator(G)
+    b = len(sources)
+    rows = [P["index"][s] for s in sources]
+    integral = bool(np.all(P["w"] == np.round(P["w"])))
+    if counts == "int64" or counts == "log":
+        dtype = np.int64 if counts == "int64" else np.float64
+    elif counts == "exact":
+        dtype = object
+        if integral:
+            P["w"] = np.array([int(x) for x in P["w"].tolist()] + [0], dtype=object)[:-1]
+    elif counts == "mod":
+        if not integral:
+            raise ValueError("Path weight sums modulo a number need integer weights.")
+        dtype = np.int64
+        P["w"] = P["w"].astype(np.int64) % modulus
+    else:
+        raise ValueError("Unknown count representation {}".format(counts))
+    count = np.zeros((P["n"], b), dtype=dtype)
+    count[rows, np.arange(b)] = 1
+    if counts == "mod" or (counts == "exact" and integral):
+        weightsum = np.zeros((P["n"], b), dtype=dtype)
+    else:
+        weightsum = np.zeros((P["n"], b))
+    logscale = np.zeros(b) # "log": the counts are count * exp(logscale)
+
+    def output(count, weightsum):
+        if counts != "log":
+            return count, weightsum
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.log(count) + logscale, np.where(count > 0, weightsum / count, 0.0)
+
+    steps = [output(count, weightsum)]
+    for i in range(k):
+        if counts == "int64":
+            checkOverflow(P, count)
+        count, weightsum = pathStep(P, count, weightsum, modulus if counts == "mod" else None)
+        if counts == "mod":
+            count %= modulus
+            weightsum %= modulus
+        elif counts == "log":
+            peak = count.max(axis=0)
+            peak[peak == 0] = 1
+            count /= peak
+            weightsum /= peak
+            logscale += np.log(peak)
+        if all_steps:
+            steps.append(output(count, weightsum))
+    if all_steps:
+        return steps
+    return output(count, weightsum)
+
+def averageWeights(G, sources, k, counts = "int64"):
+    # Average cost of the paths with exactly k edges from each source to
+    # each node, as an array of shape (n, len(sources)) laid out as in
+    # pathCountsAndSums. The average is 0 when there are no such paths.
+    # counts is one of the representations of pathCountsAndSums, except
+    # "mod" (averages cannot be taken modulo a number).
+    if counts == "mod":
+        raise ValueError("Average weights cannot be computed from counts modulo a number.")
+    count, weightsum = pathCountsAndSums(G, sources, k, counts = counts)
+    if counts == "log":
+        return weightsum
+    average = np.zeros(count.shape)
+    found = count != 0
+    average[found] = weightsum[found] / count[found]
+    return average
+
+def averageWeight(G, s, t, k, counts = "int64"):
+    # Average cost of the paths with exactly k edges from s to t, or 0
+    # if there are none. counts is as in averageWeights.
+    if counts == "mod":
+        raise ValueError("Average weights cannot be computed from counts modulo a number.")
+    row = list(G["adj"]).index(t)
+    count, weightsum = pathCountsAndSums(G, [s], k, counts = counts)
+    if counts == "log":
+        return 0 if count[row, 0] == -np.inf else float(weightsum[row, 0])
+    if count[row, 0] == 0:
+        return 0
+    return float(weightsum[row, 0] / count[row, 0])
+
+def BFCountSumPaths(G, s, k = None, engine = "dicts", counts = "int64"):
     # G is a dictionary with keys "n", "m", "adj" representing an
     # *weighted* graph where G["adj"][u][v] is the cost (length /
     # weight) of edge (u,v)
@@ -169,41 +664,40 @@ def BFCountSumPaths(G, s, k = None):
     # count[i][u] is the number of paths with i edges from s to u; (b)
     # weightsum if a list of dicts, where weightsum[i][u] is the sume
     # of path costs over all paths with i edges from s to u.
+    #
+    # engine = "matrix" computes the same values with pathCountsAndSums
+    # (one sparse matrix-vector product per step) instead of dicts, with
+    # counts as its count representation.
     n = G["n"]
     if k != None:
         limit = int(k) 
     else:
         limit = n-1
+    if engine == "matrix":
+        nodes = list(G["adj"])
+        count = []
+        weightsum = []
+        for c, ws in pathCountsAndSums(G, [s], limit, all_steps = True, counts = counts):
+            count.append(dict(zip(nodes, c[:, 0].tolist())))
+            weightsum.append(dict(zip(nodes, ws[:, 0].tolist())))
+        return count, weightsum
     # Initialize the main data structures.
     count = [{} for i in range(limit + 1)]
     weightsum = [{} for i in range(limit + 1)]
-    for i in range(limit):
+    for i in range(limit + 1):
         for u in G["adj"]:
             count[i][u] = 0
             weightsum[i][u] = 0
 
-    #
-    # YOUR CODE HERE.
-    #
-
-    for i in range(limit + 1):
-        count[s][0] = 1
-        weightsum[s][0] = 0
+    count[0][s] = 1
 
+    # every path with i edges to v is a path with i-1 edges to some u,
+    # followed by the edge (u,v)
     for i in range(1,limit+1):
-        for v in G["adj"]:
-            for u in G["adj"][v]:
-                if v not in count[i]: 
-                    count[i][v] = 0
-                
-                if u in count[i-1]:
-                    count[i][v] += count[i-1][u]
-
-                if v not in weightsum[i]:
-                    weightsum[i][v] = 0
-                
-                if u in weightsum[i-1]:
-                    weightsum[i][v] += weightsum[i-1][u]
+        for u in G["adj"]:
+            for v in G["adj"][u]:
+                count[i][v] += count[i-1][u]
+                weightsum[i][v] += weightsum[i-1][u] + count[i-1][u] * G["adj"][u][v]
 
     return count, weightsum
 
@@ -282,7 +776,7 @@ def main(args = []):
         if len(args) != 3:
             print("Problem! There were {} arguments instead of 3 for negCycle.".format(len(args)))
             return
-        G = sg.readGraph(graph_file) # Read the graph from disk
+        G = sg.readGraph(graph_file, cache = True) # Read the graph from disk
         neg_cycle_found, cycle_list = negCycle(G) #This part actually does all the work
         writeNegCycleOutput(out_file, neg_cycle_found, cycle_list) # Write the output
         if neg_cycle_found:
@@ -298,12 +792,8 @@ def main(args = []):
             return
         s = int(args[3])
         t = int(args[4])
-        G = sg.readGraph(graph_file) # Read the graph from disk
-        count, weightsum = BFCountSumPaths(G, s, k=6) # Compute path counts 
-        if count[6][t] == 0:
-            average_weight = 0
-        else:
-            average_weight = weightsum[6][t] / count[6][t]
+        G = sg.readGraph(graph_file, cache = True) # Read the graph from disk
+        average_weight = averageWeight(G, s, t, k=6) # Compute path counts and sums
         writeAverageWeightOutput(out_file, average_weight)
     else: 
         print("Problem! Task {} not recognized".format(task))
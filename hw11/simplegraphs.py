@@ -8,25 +8,88 @@
 
 
 import sys
+import os
 import heapq
-import queue
+from collections import deque
 import numpy as np
 
 
-def readGraph(input_file):
+def readGraph(input_file, cache = False):
     '''This procedure takes the name of a text file describing a directed or undirected graph and returns a data structure in memory. 
     The file is structured as follows: each line lists an edge as a pair u,v, for an unweighted graph, or triples u,v,w for a weighted graph, where w represents the edge's weight as a float.
     The data structure it returns is a dictionary with keys "n", "m", "adj" (strings). The values for "n" and "m" are the number of nodes and edges in the graph (respectively). Edges are counted as in a directed graph (so each undirected edge counts twice). The value for "adj" is a dictionary-of-dictionaries adjacency structure. 
+    Files with or without the two header lines are both accepted (see readEdges). If cache is True, the graph is loaded from (or saved to) a binary cache file next to input_file (see readCSR).
     '''
-    with open(input_file, 'r') as f:
-        raw = [[float(x) for x in s.split(',')] for s in f.read().splitlines()]
-    G = emptyGraph(0)
-    for edge in raw:
-        if len(edge)==2:
-            addDirEdge(G, int(edge[0]), int(edge[1]), label= True)
-        else:
-            addDirEdge(G, int(edge[0]), int(edge[1]), label= float(edge[2]))
-    return G
+    if cache:
+        C = readCSR(input_file, cache = True)
+        G = fromCSR(C)
+        G["m"] = C["file_m"]
+        return G
+    n, m, src, dst, w = readEdges(input_file)
+    return graphFromEdges(src, dst, w, n, m)
+
+
+def readEdges(input_file):
+    '''This procedure reads a graph file straight into NumPy arrays, without building any per-edge Python objects.
+    It accepts both file formats used in this course: an optional header of two lines holding n and m, followed by one edge per line as u,v (unweighted) or u,v,w (weighted). The two kinds of edge lines may be mixed.
+    It returns n, m, src, dst, w. The values for n and m are None if the file has no header. src and dst are integer arrays of edge endpoints, and w is a float array of edge weights, with NaN for unweighted edges.
+    '''
+    with open(input_file, 'rb') as f:
+        data = f.read().rstrip()
+    if not data: # no edges at all
+        return None, None, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    data += b'\n'
+    raw = np.frombuffer(data, dtype=np.uint8)
+    line_ends = np.flatnonzero(raw == ord('\n'))
+    commas = np.flatnonzero(raw == ord(','))
+    # number of values on each line
+    cols = np.bincount(np.searchsorted(line_ends, commas), minlength=len(line_ends)) + 1
+    vals = np.fromstring(data.replace(b',', b' ').decode(), sep=' ')
+    if len(vals) != cols.sum():
+        raise ValueError("Could not parse {} as a graph file.".format(input_file))
+    starts = np.concatenate(([0], np.cumsum(cols)[:-1]))
+    if len(cols) >= 2 and cols[0] == 1 and cols[1] == 1: # header lines with n and m
+        n = int(vals[0])
+        m = int(vals[1])
+        cols = cols[2:]
+        starts = starts[2:]
+    else:
+        n = None
+        m = None
+    src = vals[starts].astype(np.int64)
+    dst = vals[starts + 1].astype(np.int64)
+    w = np.full(len(starts), np.nan)
+    weighted = cols >= 3
+    w[weighted] = vals[starts[weighted] + 2]
+    return n, m, src, dst, w
+
+def edgeNodes(src, dst):
+    # Returns the distinct endpoints of the edges, in the order in which
+    # they first appear (the order in which addDirEdge would add them).
+    ends = np.empty(2 * len(src), dtype=np.int64)
+    ends[0::2] = src
+    ends[1::2] = dst
+    names, first = np.unique(ends, return_index=True)
+    return names[np.argsort(first)]
+
+def graphFromEdges(src, dst, w, n = None, m = None):
+    # Builds the dictionary-of-dictionaries representation from edge
+    # arrays (as returned by readEdges) in a single pass. If n is given,
+    # the nodes are 0,...,n-1; otherwise they are the endpoints of the
+    # edges. Edges whose weight is NaN get the label True.
+    if n is None:
+        nodes = edgeNodes(src, dst).tolist()
+    else:
+        nodes = range(n)
+    adj = {u: {} for u in nodes}
+    labels = w.tolist()
+    for i in np.flatnonzero(np.isnan(w)).tolist():
+        labels[i] = True
+    for u, v, label in zip(src.tolist(), dst.tolist(), labels):
+        adj[u][v] = label
+    if m is None:
+        m = len(src)
+    return {"n": len(adj), "m": m, "adj": adj}
 
 
 
@@ -245,21 +308,33 @@ def oneNegCycle(n):
 # Traversals
 ############################################################
 
-def BFS(G, s):
+def BFS(G, s, direction = "topdown"):
     # G is a dictionary with keys "n", "m", "adj" representing an unweighted graph
+    # direction = "hybrid" uses direction-optimizing BFS (see csrHybridBFS),
+    # which is much faster on large graphs with small diameter. A
+    # dictionary graph is converted (and transposed) on every such call,
+    # so for repeated searches convert it once with toCSR.
+    if direction == "hybrid":
+        return csrHybridBFS(G if "indptr" in G else toCSR(G), s)
+    elif direction != "topdown":
+        raise ValueError("Unknown direction: {}".format(direction))
+    if "indptr" in G: # G is a CSR graph
+        return csrBFS(G, s)
     # G["adj"][u][v] is True if (u,v) is present. Otherwise, v is not in G["ad"][u].
     distances = {}
     finalized = {} # set of discovered nodes
     parents = {} # lists parent of node in SP tree
-    layers = [[] for d in range(G["n"])] # lists of nodes at each distance.
-    Q = queue.Queue()
+    layers = [] # lists of nodes at each distance.
+    Q = deque()
     distances[s] = 0
     parents[s] = None
-    Q.put(s)
-    while not(Q.empty()): #Q not empty
-        u = Q.get()
+    Q.append(s)
+    while len(Q) > 0: #Q not empty
+        u = Q.popleft()
         if u not in finalized: #if u was already finalized, ignore it.
             finalized[u] = True
+            if distances[u] == len(layers): # first node at this distance
+                layers.append([])
             layers[distances[u]].append(u) 
             for v in G["adj"][u]:
                 # record v's distance and parent and add v to the queue if  
@@ -267,45 +342,40 @@ def BFS(G, s):
                 if (v not in distances): # first path to v
                     distances[v] = distances[u] + 1
                     parents[v] = u
-                    Q.put(v)
+                    Q.append(v)
     return distances, parents, layers
 
 def DFS(G):
-    color = {}
-    discovered = {}
-    finished = {}
-    parent = {}
-    for u in G["adj"]:
-        color[u] = "white"
-        parent[u] = None
-    timestamp = [0] #This is a list whose only element is the current value of the time stamp. 
-
-    def DFSVisit(u,  G, timestamp, color, discovered, finished):
-        # Only the first argument ever changes
-        color[u] = "gray"
-        timestamp[0] = timestamp[0] + 1
-        discovered[u] = timestamp[0]
-        for v in G["adj"][u]:
-            if color[v] == "white":
-                    parent[v] = u
-                    DFSVisit(v,  G, timestamp, color, discovered, finished)
-        color[u] = "black"
-        timestamp[0] = timestamp[0] + 1
-        finished[u] = timestamp[0]
-        return
-
-    for u in G["adj"]:
-        if color[u] == "white":
-            DFSVisit(u, G, timestamp, color, discovered, finished)
-    return discovered, finished, parent
+    # Depth-first search over the whole graph, visiting nodes and their
+    # neighbors in the order they are listed in G["adj"]. Returns dicts
+    # of discovery times, finishing times and parents in the DFS forest.
+    # It uses an explicit stack (see csrDFSOrder), so long paths do not
+    # hit Python's recursion limit.
+    return csrDFS(G if "indptr" in G else toCSR(G))
 
 
-def dijkstra(G, s):
+def dijkstra(G, s, workspace = None, queue = "heapq", target = None):
     # G is a dictionary with keys "n", "m", "adj" representing an *weighted* graph
     # G["adj"][u][v] is the cost (length / weight) of edge (u,v)
     # This algorithms finds least-costs paths to all vertices
     # Returns an array of distances (path costs) and parents in the lightest-paths tree.
     # Assumes nonnegative path costs
+    # If a workspace from dijkstraWorkspace(G) is given, it is used
+    # instead of allocating new structures (useful for repeated runs).
+    # Otherwise a CSR graph gets O(n) new buffers per call, and a
+    # dictionary graph is converted on every call that needs them.
+    # queue chooses the priority queue, see workspaceDijkstra.
+    # If a target node is given, the search stops as soon as the
+    # lightest path to it is known. Only the distances of the nodes
+    # finalized by then are final; the others are upper bounds. On a
+    # dictionary graph with queue "heapq", or with a workspace, such a
+    # query only touches the nodes it reaches, not the whole graph.
+    if "indptr" in G: # G is a CSR graph
+        return csrDijkstra(G, s, queue = queue, target = target, workspace = workspace)
+    if workspace is not None or queue != "heapq":
+        W = workspace if workspace is not None else dijkstraWorkspace(G)
+        t = W["index"][target] if target is not None else -1
+        return workspaceTree(W, workspaceDijkstra(W, W["index"][s], queue = queue, target = t))
     distances = {} # actual distances
     finalized = {} # set of discovered nodes
     parents = {} # lists parent of node in SP tree
@@ -317,6 +387,8 @@ def dijkstra(G, s):
         (d, u) = heapq.heappop(Q)
         if u not in finalized: #if u was already finalized, ignore it.
             finalized[u] = True
+            if u == target: # lightest path to the target found
+                break
             for v in G["adj"][u]:
                 new_length = distances[u] + G["adj"][u][v]
                 # update v's distance (and parent and priority queue) if  
@@ -328,3 +400,889 @@ def dijkstra(G, s):
                     # add a copy of v to the queue with priority distances[v]
                     heapq.heappush(Q, (distances[v], v)) 
     return distances, parents
+
+def bidirectionalDijkstra(G, s, t, R = None):
+    # Finds a lightest path from s to t by running Dijkstra's algorithm
+    # forward from s in G and backward from t in R = reverseGraph(G) at
+    # the same time, always advancing the side whose next node is
+    # closer. It stops once the two next distances add up to at least
+    # the lightest s-t path seen so far, so both searches usually stay
+    # within a small neighborhood of s and t. Pass R to reuse it over
+    # many queries. Returns the cost of the path and the path as a list
+    # of nodes from s to t, or np.inf and [] if t is not reachable.
+    # Assumes nonnegative path costs
+    if R is None:
+        R = reverseGraph(G)
+    if s == t:
+        return 0, [s]
+    adj = [G["adj"], R["adj"]]
+    distances = [{s: 0}, {t: 0}]
+    parents = [{s: None}, {t: None}] # parent towards s, resp. towards t
+    finalized = [{}, {}]
+    Q = [[(0, s)], [(0, t)]]
+    best = np.inf # cost of the lightest s-t path seen so far
+    meet = None # a node on that path
+    while len(Q[0]) > 0 and len(Q[1]) > 0:
+        if Q[0][0][0] + Q[1][0][0] >= best:
+            break
+        side = 0 if Q[0][0][0] <= Q[1][0][0] else 1
+        (d, u) = heapq.heappop(Q[side])
+        if u in finalized[side]:
+            continue
+        finalized[side][u] = True
+        dist = distances[side]
+        other = distances[1 - side]
+        for v in adj[side][u]:
+            new_length = d + adj[side][u][v]
+            if (v not in dist) or (new_length < dist[v]):
+                dist[v] = new_length
+                parents[side][v] = u
+                heapq.heappush(Q[side], (new_length, v))
+            # a path s -> v found by one side and v -> t by the other
+            if v in other and dist[v] + other[v] < best:
+                best = dist[v] + other[v]
+                meet = v
+    if meet is None:
+        return np.inf, []
+    path = []
+    u = meet
+    while u is not None:
+        path.append(u)
+        u = parents[0][u]
+    path.reverse()
+    u = parents[1][meet]
+    while u is not None:
+        path.append(u)
+        u = parents[1][u]
+    return best, path
+
+
+############################################################
+# Compact (CSR) graphs
+############################################################
+
+# A CSR ("compressed sparse row") graph stores the same information as
+# the dictionary-of-dictionaries structure in three flat arrays, which
+# takes a small fraction of the memory for large graphs. Nodes are
+# numbered 0,...,n-1 internally; C["nodes"][i] is the name of node i in
+# the dictionary representation. The out-neighbors of node i are
+# C["indices"][C["indptr"][i]:C["indptr"][i+1]], and the weights of
+# the corresponding edges are the same slice of C["weights"].
+# Unweighted edges are stored with weight 1.0 and C["weighted"] False.
+# If a weighted graph also has unweighted edges (label True), the
+# optional boolean array C["true_labels"] marks them.
+# The searches below read the arrays in place through memoryviews,
+# whose items are plain Python ints and floats, so a search only
+# allocates O(n) lists of its own (distances, parents and the like)
+# and never a copy of the edges.
+
+def CSRGraph(nodes, indptr, indices, weights, weighted = True):
+    # Builds a CSR graph from its arrays. Like the dictionary
+    # representation, C is a dictionary with keys "n" and "m".
+    C = {"n": len(indptr) - 1,
+         "m": len(indices),
+         "nodes": np.asarray(nodes),
+         "indptr": np.asarray(indptr, dtype=np.int32),
+         "indices": np.asarray(indices, dtype=np.int32),
+         "weights": np.asarray(weights, dtype=np.float64),
+         "weighted": bool(weighted)}
+    return C
+
+def toCSR(G):
+    # Converts a graph in the dictionary representation to a CSR graph.
+    # Nodes keep the order in which they appear in G["adj"].
+    nodes = list(G["adj"].keys())
+    index = {u: i for i, u in enumerate(nodes)}
+    degrees = []
+    targets = []
+    labels = []
+    for u in nodes:
+        nbrs = G["adj"][u]
+        degrees.append(len(nbrs))
+        targets.extend([index[v] for v in nbrs])
+        labels.extend(nbrs.values())
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int32)
+    np.cumsum(degrees, out=indptr[1:])
+    weighted = any(label is not True for label in labels)
+    if all(isinstance(u, (int, np.integer)) for u in nodes):
+        names = np.array(nodes, dtype=np.int64)
+    else:
+        names = np.array(nodes, dtype=object) # e.g. a string node like "s"
+    C = CSRGraph(names, indptr, targets, np.array(labels, dtype=np.float64), weighted)
+    C["index"] = index
+    if weighted and any(label is True for label in labels):
+        C["true_labels"] = np.array([label is True for label in labels])
+    return C
+
+def fromCSR(C):
+    # Converts a CSR graph back to the dictionary representation.
+    nodes = C["nodes"].tolist()
+    indptr = C["indptr"].tolist()
+    indices = C["indices"].tolist()
+    if C["weighted"]:
+        labels = C["weights"].tolist()
+        if "true_labels" in C: # unweighted edges in a weighted graph
+            for k in np.flatnonzero(C["true_labels"]).tolist():
+                labels[k] = True
+    else:
+        labels = [True] * len(indices)
+    G = {"n": len(nodes), "m": len(indices), "adj": {}}
+    for i, u in enumerate(nodes):
+        lo, hi = indptr[i], indptr[i+1]
+        G["adj"][u] = dict(zip([nodes[j] for j in indices[lo:hi]], labels[lo:hi]))
+    return G
+
+def csrFromEdges(src, dst, w, n = None):
+    # Builds a CSR graph directly from edge arrays (as returned by
+    # readEdges), with the same nodes and edges as graphFromEdges.
+    if n is None:
+        nodes = edgeNodes(src, dst)
+        perm = np.argsort(nodes)
+        s = perm[np.searchsorted(nodes[perm], src)]
+        t = perm[np.searchsorted(nodes[perm], dst)]
+    else:
+        nodes = np.arange(n, dtype=np.int64)
+        s = src
+        t = dst
+    keys = s * len(nodes) + t
+    _, first, inv = np.unique(keys, return_index=True, return_inverse=True)
+    if len(first) < len(keys):
+        # repeated edges: keep the first position and the last weight,
+        # which is what repeated assignments to G["adj"][u][v] do
+        last = np.zeros(len(first), dtype=np.int64)
+        np.maximum.at(last, inv.ravel(), np.arange(len(keys)))
+        keep = np.sort(first)
+        w = w[last[inv.ravel()[keep]]]
+        s = s[keep]
+        t = t[keep]
+    order = np.argsort(s, kind="stable")
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(s, minlength=len(nodes)), out=indptr[1:])
+    weighted = not np.isnan(w).all()
+    weights = np.where(np.isnan(w), 1.0, w)[order]
+    C = CSRGraph(nodes, indptr, t[order], weights, weighted)
+    if weighted and np.isnan(w).any():
+        C["true_labels"] = np.isnan(w)[order]
+    return C
+
+
+def csrIndex(C):
+    # Returns the dict mapping node names to CSR indices, building it
+    # the first time it is needed.
+    if "index" not in C:
+        C["index"] = {u: i for i, u in enumerate(C["nodes"].tolist())}
+    return C["index"]
+
+def csrBFS(C, s):
+    # BFS on a CSR graph. Returns distances, parents and layers in the
+    # same format as BFS (keyed by node names).
+    indptr = memoryview(C["indptr"])
+    indices = memoryview(C["indices"])
+    dist = [-1] * C["n"]
+    par = [-1] * C["n"]
+    src = csrIndex(C)[s]
+    dist[src] = 0
+    order = [src] # nodes in the order they were discovered; doubles as the queue
+    head = 0
+    while head < len(order):
+        u = order[head]
+        head += 1
+        du = dist[u] + 1
+        for v in indices[indptr[u]:indptr[u+1]]:
+            if dist[v] < 0: # first path to v
+                dist[v] = du
+                par[v] = u
+                order.append(v)
+    return csrBFSTree(C, dist, par, order)
+
+def csrBFSTree(C, dist, par, order):
+    # Converts the distance and parent lists of a BFS on a CSR graph,
+    # and the list of nodes in the order they were discovered, to the
+    # distances, parents and layers returned by BFS.
+    nodes = C["nodes"].tolist()
+    distances = {}
+    parents = {}
+    layers = [[] for d in range(dist[order[-1]] + 1)]
+    for u in order:
+        distances[nodes[u]] = dist[u]
+        parents[nodes[u]] = nodes[par[u]] if par[u] >= 0 else None
+        layers[dist[u]].append(nodes[u])
+    return distances, parents, layers
+
+def csrTranspose(C):
+    # Returns the CSR graph with every edge of C reversed, like
+    # reverseGraph. It is computed once and kept in C["transpose"].
+    if "transpose" not in C:
+        indptr = np.asarray(C["indptr"], dtype=np.int64)
+        indices = np.asarray(C["indices"], dtype=np.int64)
+        heads = np.repeat(np.arange(C["n"]), np.diff(indptr))
+        order = np.argsort(indices, kind="stable")
+        rev_indptr = np.zeros(C["n"] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices, minlength=C["n"]), out=rev_indptr[1:])
+        T = CSRGraph(C["nodes"], rev_indptr, heads[order], np.asarray(C["weights"])[order], C["weighted"])
+        if "index" in C:
+            T["index"] = C["index"]
+        C["transpose"] = T
+    return C["transpose"]
+
+def csrHybridBFS(C, s, alpha = 14, beta = 24):
+    # Direction-optimizing BFS (Beamer, Asanovic and Patterson) on a CSR
+    # graph. Returns distances, parents and layers in the same format as
+    # BFS; the distances are the same, but ties between parents may be
+    # broken differently. Each layer is built either top-down, scanning
+    # the out-edges of the frontier, or bottom-up, letting every
+    # unvisited node look through its in-edges (in csrTranspose(C)) for
+    # a parent in the frontier and stop at the first one. Bottom-up is
+    # used while the frontier has more than 1/alpha of the edges left to
+    # check, until the frontier shrinks below n/beta nodes.
+    # The arrays of C and its transpose (kept in C as NumPy arrays, see
+    # csrTranspose) are read in place, so repeated searches only pay
+    # for the edges they look at.
+    T = csrTranspose(C)
+    indptr = memoryview(C["indptr"])
+    indices = memoryview(C["indices"])
+    rev_indptr = memoryview(T["indptr"])
+    rev_indices = memoryview(T["indices"])
+    n = C["n"]
+    dist = [-1] * n
+    par = [-1] * n
+    src = csrIndex(C)[s]
+    dist[src] = 0
+    order = [src]
+    frontier = [src]
+    unvisited = None # unvisited nodes, kept only while going bottom-up
+    edges_left = C["m"] - (rev_indptr[src+1] - rev_indptr[src]) # in-edges of unvisited nodes
+    bottom_up = False
+    layer = 0
+    while frontier:
+        frontier_edges = sum(indptr[u+1] - indptr[u] for u in frontier)
+        if not bottom_up and frontier_edges > edges_left / alpha:
+            bottom_up = True
+        elif bottom_up and len(frontier) < n / beta:
+            bottom_up = False
+        nxt = []
+        if bottom_up:
+            if unvisited is None:
+                unvisited = [v for v in range(n) if dist[v] < 0]
+            still_unvisited = []
+            for v in unvisited:
+                for u in rev_indices[rev_indptr[v]:rev_indptr[v+1]]:
+                    if dist[u] == layer: # u is in the frontier
+                        dist[v] = layer + 1
+                        par[v] = u
+                        nxt.append(v)
+                        break
+                else:
+                    still_unvisited.append(v)
+            unvisited = still_unvisited
+        else:
+            unvisited = None
+            for u in frontier:
+                for v in indices[indptr[u]:indptr[u+1]]:
+                    if dist[v] < 0: # first path to v
+                        dist[v] = layer + 1
+                        par[v] = u
+                        nxt.append(v)
+        edges_left -= sum(rev_indptr[v+1] - rev_indptr[v] for v in nxt)
+        order.extend(nxt)
+        frontier = nxt
+        layer += 1
+    return csrBFSTree(C, dist, par, order)
+
+def csrDFS(C):
+    # DFS on a CSR graph, visiting nodes in the same order as DFS.
+    # Returns discovered, finished and parent dicts.
+    nodes = C["nodes"].tolist()
+    disc, fin, par, preorder, postorder = csrDFSOrder(C)
+    discovered = dict(zip(nodes, disc.tolist()))
+    finished = dict(zip(nodes, fin.tolist()))
+    parent = {nodes[u]: (nodes[p] if p >= 0 else None) for u, p in enumerate(par.tolist())}
+    return discovered, finished, parent
+
+def csrDFSOrder(C, roots = None):
+    # Iterative DFS on a CSR graph. New trees are started from the nodes
+    # of roots (indices; all nodes in order by default) that are still
+    # undiscovered when their turn comes. Returns NumPy arrays indexed
+    # by node: discovery and finishing timestamps (as in DFS, 0 for
+    # nodes never reached) and parents (-1 for roots and unreached
+    # nodes), followed by the node indices in the order they were
+    # discovered (preorder) and finished (postorder).
+    indptr = memoryview(C["indptr"])
+    indices = memoryview(C["indices"])
+    n = C["n"]
+    if roots is None:
+        roots = range(n)
+    else:
+        roots = np.asarray(roots).tolist()
+    disc = [0] * n # 0 means undiscovered ("white")
+    fin = [0] * n
+    par = [-1] * n
+    preorder = []
+    postorder = []
+    nxt = C["indptr"][:n].tolist() # position of the next out-edge to scan for each node
+    timestamp = 0
+    for r in roots:
+        if disc[r]:
+            continue
+        timestamp += 1
+        disc[r] = timestamp
+        preorder.append(r)
+        stack = [r]
+        while stack:
+            u = stack[-1]
+            k = nxt[u]
+            end = indptr[u+1]
+            while k < end and disc[indices[k]]:
+                k += 1
+            if k < end:
+                v = indices[k]
+                nxt[u] = k + 1
+                par[v] = u
+                timestamp += 1
+                disc[v] = timestamp
+                preorder.append(v)
+                stack.append(v)
+            else:
+                nxt[u] = end
+                stack.pop()
+                timestamp += 1
+                fin[u] = timestamp
+                postorder.append(u)
+    return (np.array(disc, dtype=np.int64), np.array(fin, dtype=np.int64), np.array(par, dtype=np.int64),
+            np.array(preorder, dtype=np.int64), np.array(postorder, dtype=np.int64))
+
+def csrDijkstra(C, s, queue = "heapq", target = None, workspace = None):
+    # Dijkstra's algorithm on a CSR graph. Returns distances and parents
+    # in the same format as dijkstra. Assumes nonnegative weights.
+    # Without a workspace, the call allocates O(n) buffers (but does not
+    # copy the edges); pass one from dijkstraWorkspace(C) to make
+    # repeated queries cost only the part of the graph they explore.
+    W = workspace if workspace is not None else dijkstraWorkspace(C)
+    t = W["index"][target] if target is not None else -1
+    return workspaceTree(W, workspaceDijkstra(W, W["index"][s], queue = queue, target = t))
+
+def readCSR(input_file, cache = False):
+    # Reads a graph file (in either format accepted by readEdges)
+    # directly into a CSR graph. C["file_m"] is the edge count that
+    # readGraph reports for the same file.
+    #
+    # If cache is True, the arrays are also saved in a binary file next
+    # to input_file (see csrCacheFile). Later calls load them from there
+    # through np.memmap, as long as input_file has not changed since,
+    # so they start almost instantly and processes reading the same
+    # graph share its pages.
+    if cache:
+        C = readCSRCache(csrCacheFile(input_file), input_file)
+        if C is not None:
+            return C
+    n, m, src, dst, w = readEdges(input_file)
+    C = csrFromEdges(src, dst, w, n)
+    C["file_m"] = len(src) if m is None else m
+    if cache:
+        try:
+            writeCSRCache(C, csrCacheFile(input_file), input_file)
+        except OSError:
+            pass # e.g. a read-only directory; just skip the cache
+    return C
+
+############################################################
+# Binary graph cache
+############################################################
+
+# A cache file holds a header of 16 int64 values followed by the CSR
+# arrays, each stored raw (as in a .npy file without its own header) and
+# padded to a multiple of 8 bytes. The header records the size and
+# modification time of the text file the cache was built from, so a
+# stale cache is detected and rebuilt.
+
+CSR_CACHE_MAGIC = 0x53474353 # "SCGS"
+CSR_CACHE_VERSION = 1
+CSR_CACHE_ARRAYS = [("nodes", np.int64), ("indptr", np.int32), ("indices", np.int32),
+                    ("weights", np.float64), ("true_labels", np.bool_)]
+
+def csrCacheFile(input_file):
+    return input_file + ".csr"
+
+def writeCSRCache(C, cache_file, source_file):
+    # Saves the CSR graph C (read from source_file) to cache_file. The
+    # file is written under a temporary name and then renamed, so other
+    # processes never see a partial cache.
+    st = os.stat(source_file)
+    lengths = [C["n"], C["n"] + 1, C["m"], C["m"], len(C.get("true_labels", []))]
+    header = np.zeros(16, dtype=np.int64)
+    header[:9] = [CSR_CACHE_MAGIC, CSR_CACHE_VERSION, st.st_size, st.st_mtime_ns,
+                  int(C["weighted"]), C.get("file_m", C["m"]), C["n"], C["m"], lengths[4]]
+    tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+    with open(tmp_file, 'wb') as f:
+        f.write(header.tobytes())
+        for (key, dtype), length in zip(CSR_CACHE_ARRAYS, lengths):
+            if length > 0:
+                data = np.ascontiguousarray(C[key], dtype=dtype).tobytes()
+                f.write(data + bytes(-len(data) % 8))
+    os.replace(tmp_file, cache_file)
+    return
+
+def readCSRCache(cache_file, source_file):
+    # Loads a CSR graph saved by writeCSRCache, with its arrays
+    # memory-mapped read-only. Returns None if there is no cache or if
+    # source_file has changed since the cache was written.
+    try:
+        st = os.stat(source_file)
+        header = np.fromfile(cache_file, dtype=np.int64, count=16)
+    except OSError:
+        return None
+    if (len(header) < 16 or header[0] != CSR_CACHE_MAGIC or header[1] != CSR_CACHE_VERSION
+            or header[2] != st.st_size or header[3] != st.st_mtime_ns):
+        return None
+    n = int(header[6])
+    m = int(header[7])
+    lengths = [n, n + 1, m, m, int(header[8])]
+    arrays = {}
+    offset = header.nbytes
+    for (key, dtype), length in zip(CSR_CACHE_ARRAYS, lengths):
+        if length > 0:
+            arrays[key] = np.memmap(cache_file, dtype=dtype, mode='r', offset=offset, shape=(length,))
+        else:
+            arrays[key] = np.zeros(0, dtype=dtype)
+        nbytes = length * np.dtype(dtype).itemsize
+        offset += nbytes + (-nbytes % 8)
+    C = CSRGraph(arrays["nodes"], arrays["indptr"], arrays["indices"], arrays["weights"], bool(header[4]))
+    if lengths[4] > 0:
+        C["true_labels"] = arrays["true_labels"]
+    C["file_m"] = int(header[5])
+    return C
+
+
+############################################################
+# Dijkstra workspaces
+############################################################
+
+# Running Dijkstra's algorithm from many sources of the same graph
+# spends much of its time building and throwing away dicts. A workspace
+# W = dijkstraWorkspace(G) holds memoryviews of the CSR arrays of G
+# (no copies of the edges), plus the node names and distance, parent
+# and finalized lists indexed 0,...,n-1 that are reused by every run.
+# The caller owns W and keeps it as long as it runs queries; it is not
+# stored in G. Instead of clearing the buffers, each run gets a new
+# epoch number: W["dist"][v] and W["par"][v] are only valid if
+# W["seen"][v] equals W["epoch"], and v is finalized if W["done"][v]
+# equals W["epoch"]. So a run costs nothing beyond the nodes it touches.
+
+def dijkstraWorkspace(G):
+    # Builds a workspace for G, which can be a dictionary or CSR graph.
+    C = G if "indptr" in G else toCSR(G)
+    n = C["n"]
+    W = {"n": n,
+         "nodes": C["nodes"].tolist(),
+         "index": csrIndex(C),
+         "indptr": memoryview(C["indptr"]),
+         "indices": memoryview(C["indices"]),
+         "weights": memoryview(C["weights"]),
+         "dist": [np.inf] * n,
+         "par": [-1] * n,
+         "seen": [0] * n,
+         "done": [0] * n,
+         "epoch": 0}
+    return W
+
+def workspaceDijkstra(W, s, bound = np.inf, cycle = False, queue = "heapq", target = -1):
+    # Runs Dijkstra's algorithm in workspace W from the node with index
+    # s, and returns the list of indices of the nodes it reached. Paths
+    # of cost bound or more are not followed. Edges back into s are not
+    # relaxed; the lightest one closes the lightest cycle through s,
+    # whose cost and last node before s are stored in W["cycle_cost"]
+    # and W["cycle_parent"] (np.inf and -1 if there is none). If cycle
+    # is True, the run stops as soon as no lighter cycle through s can
+    # be found, so the distances of the remaining nodes may not be final.
+    # Likewise, the run stops once the node with index target (if any)
+    # is finalized.
+    # queue is one of
+    #   "heapq":   heapq with a new entry per improvement; stale entries
+    #              are skipped when popped
+    #   "indexed": an indexed binary heap with decrease-key
+    #   "bucket":  a bucket queue (Dial's algorithm); needs nonnegative
+    #              integer weights, and the distances are ints
+    W["epoch"] += 1
+    epoch = W["epoch"]
+    indptr = W["indptr"]
+    indices = W["indices"]
+    weights = W["weights"]
+    if queue == "heapq":
+        Q = []
+        def push(d, v):
+            heapq.heappush(Q, (d, v))
+        def pop():
+            return heapq.heappop(Q) if Q else None
+    elif queue == "indexed":
+        if "heap" not in W:
+            W["heap"] = indexedHeap(W["n"])
+        H = W["heap"]
+        heapClear(H)
+        def push(d, v):
+            heapUpdate(H, v, d)
+        def pop():
+            return heapPop(H) if H["heap"] else None
+    elif queue == "bucket":
+        if "buckets" not in W:
+            W["buckets"] = bucketQueue(integerWeights(W))
+        B = W["buckets"]
+        bucketClear(B)
+        weights = W["int_weights"]
+        def push(d, v):
+            bucketPush(B, v, d)
+        def pop():
+            return bucketPop(B) if B["size"] else None
+    else:
+        raise ValueError("Unknown queue: {}".format(queue))
+    dist = W["dist"]
+    par = W["par"]
+    seen = W["seen"]
+    done = W["done"]
+    dist[s] = 0
+    par[s] = -1
+    seen[s] = epoch
+    reached = [s]
+    cycle_cost = np.inf
+    cycle_parent = -1
+    push(0, s)
+    while True:
+        top = pop()
+        if top is None:
+            break
+        (d, u) = top
+        if cycle and d >= cycle_cost:
+            break
+        if done[u] == epoch:
+            continue
+        done[u] = epoch
+        if u == target:
+            break
+        for k in range(indptr[u], indptr[u+1]):
+            v = indices[k]
+            new_length = d + weights[k]
+            if new_length >= bound:
+                continue
+            if v == s:
+                if new_length < cycle_cost:
+                    cycle_cost = new_length
+                    cycle_parent = u
+            elif seen[v] != epoch:
+                # first path to v in this run
+                seen[v] = epoch
+                reached.append(v)
+                dist[v] = new_length
+                par[v] = u
+                push(new_length, v)
+            elif new_length < dist[v]:
+                dist[v] = new_length
+                par[v] = u
+                push(new_length, v)
+    W["cycle_cost"] = cycle_cost
+    W["cycle_parent"] = cycle_parent
+    return reached
+
+def workspaceTree(W, reached):
+    # Returns the distances and parents of the last run in W, keyed by
+    # node names, in the same format as dijkstra.
+    nodes = W["nodes"]
+    dist = W["dist"]
+    par = W["par"]
+    distances = {nodes[u]: dist[u] for u in reached}
+    parents = {nodes[u]: (nodes[par[u]] if par[u] >= 0 else None) for u in reached}
+    return distances, parents
+
+
+############################################################
+# Priority queues
+############################################################
+
+# Queues of node indices 0,...,n-1 keyed by distance, for
+# workspaceDijkstra. Both are dictionaries of flat lists, and both
+# return (key, v) pairs from their pop functions like heapq does.
+
+def indexedHeap(n):
+    # An indexed binary heap: H["heap"] is a binary min-heap of nodes
+    # ordered by H["key"], and H["pos"][v] is the position of v in
+    # H["heap"] (-1 if v is not in the heap). Knowing where v is lets
+    # heapUpdate lower its key in place instead of adding a new entry.
+    H = {"heap": [], "key": [np.inf] * n, "pos": [-1] * n}
+    return H
+
+def heapClear(H):
+    # Empties H in time proportional to its size.
+    for v in H["heap"]:
+        H["pos"][v] = -1
+    H["heap"].clear()
+
+def heapSiftUp(H, i):
+    heap = H["heap"]
+    key = H["key"]
+    pos = H["pos"]
+    v = heap[i]
+    while i > 0:
+        p = (i - 1) >> 1
+        u = heap[p]
+        if key[u] <= key[v]:
+            break
+        heap[i] = u
+        pos[u] = i
+        i = p
+    heap[i] = v
+    pos[v] = i
+
+def heapSiftDown(H, i):
+    heap = H["heap"]
+    key = H["key"]
+    pos = H["pos"]
+    size = len(heap)
+    v = heap[i]
+    while True:
+        c = 2 * i + 1
+        if c >= size:
+            break
+        if c + 1 < size and key[heap[c + 1]] < key[heap[c]]:
+            c += 1
+        u = heap[c]
+        if key[v] <= key[u]:
+            break
+        heap[i] = u
+        pos[u] = i
+        i = c
+    heap[i] = v
+    pos[v] = i
+
+def heapUpdate(H, v, k):
+    # Inserts v with key k, or lowers the key of v to k if v is already
+    # in the heap with a larger key.
+    if H["pos"][v] < 0:
+        H["key"][v] = k
+        H["heap"].append(v)
+        heapSiftUp(H, len(H["heap"]) - 1)
+    elif k < H["key"][v]:
+        H["key"][v] = k
+        heapSiftUp(H, H["pos"][v])
+
+def heapPop(H):
+    # Removes and returns (key, v) for the node v with the smallest key.
+    heap = H["heap"]
+    v = heap[0]
+    last = heap.pop()
+    H["pos"][v] = -1
+    if heap:
+        heap[0] = last
+        heapSiftDown(H, 0)
+    return H["key"][v], v
+
+def integerWeights(W):
+    # Checks that the weights in workspace W are nonnegative integers,
+    # stores them as ints in W["int_weights"], and returns the largest.
+    weights = [int(w) for w in W["weights"]]
+    if any(w < 0 or w != x for w, x in zip(weights, W["weights"])):
+        raise ValueError("Bucket queues need nonnegative integer weights.")
+    W["int_weights"] = weights
+    return max(weights, default = 0)
+
+def bucketQueue(max_weight):
+    # A bucket queue for Dijkstra's algorithm with integer weights of at
+    # most max_weight (Dial's algorithm). Nodes with key d are kept in
+    # B["buckets"][d % (max_weight+1)]; since all keys in the queue are
+    # between the last popped key and that plus max_weight, max_weight+1
+    # buckets used round-robin are enough. Nodes whose key decreases are
+    # just added again, and the old entries are popped later as stale.
+    # B["full"][i] is 1 if bucket i is not empty, so bucketPop can skip
+    # runs of empty buckets with bytearray.find, and B["used"] lists the
+    # buckets that were filled since the last bucketClear, so clearing
+    # does not scan all of them.
+    B = {"buckets": [[] for i in range(max_weight + 1)], "full": bytearray(max_weight + 1),
+         "used": [], "cur": 0, "size": 0}
+    return B
+
+def bucketClear(B):
+    # Empties B in time proportional to the number of pushes since the
+    # last clear, however many buckets there are.
+    buckets = B["buckets"]
+    full = B["full"]
+    if B["size"]:
+        for i in B["used"]:
+            buckets[i].clear()
+            full[i] = 0
+    B["used"].clear()
+    B["cur"] = 0
+    B["size"] = 0
+
+def bucketPush(B, v, k):
+    i = k % len(B["buckets"])
+    bucket = B["buckets"][i]
+    if not bucket:
+        B["used"].append(i)
+        B["full"][i] = 1
+    bucket.append(v)
+    B["size"] += 1
+
+def bucketPop(B):
+    # Removes and returns (key, v) for a node v with the smallest key.
+    buckets = B["buckets"]
+    full = B["full"]
+    nb = len(buckets)
+    cur = B["cur"]
+    i = cur % nb
+    if not full[i]:
+        # next nonempty bucket, wrapping around past the last one
+        j = full.find(1, i)
+        if j < 0:
+            j = full.find(1)
+        cur += (j - i) % nb
+        i = j
+    bucket = buckets[i]
+    v = bucket.pop()
+    if not bucket:
+        full[i] = 0
+    B["cur"] = cur
+    B["size"] -= 1
+    return cur, v
+
+
+############################################################
+# Multi-source BFS
+############################################################
+
+# multiBFS runs BFS from many sources at once. Each source gets one bit,
+# and for every node the bits of the sources whose BFS has reached it
+# are packed into uint64 words, so a single word operation moves 64
+# BFS's along an edge. Each layer is then one OR over the neighbors of
+# every node (neighborBits), vectorized over the CSR arrays.
+
+def neighborBits(bits, indptr, indices):
+    # bits has one row of words per node. Returns the array whose row u
+    # is the OR of the rows of bits over the out-neighbors of u.
+    out = np.zeros_like(bits)
+    if len(indices) == 0:
+        return out
+    starts = indptr[:-1]
+    nonempty = starts < indptr[1:] # reduceat does not handle empty rows
+    out[nonempty] = np.bitwise_or.reduceat(bits[indices], starts[nonempty], axis=0)
+    return out
+
+def packBits(mask, nwords):
+    # Packs a boolean array into nwords uint64 words, bit i of the
+    # result being mask[i].
+    padded = np.zeros(nwords * 64, dtype=bool)
+    padded[:len(mask)] = mask
+    return np.packbits(padded, bitorder='little').view('<u8')
+
+def unpackBits(words, nbits):
+    # Inverse of packBits, row by row: returns a boolean array with
+    # nbits columns for a 2D array of words.
+    return np.unpackbits(np.ascontiguousarray(words).view(np.uint8), axis=1, bitorder='little')[:, :nbits].astype(bool)
+
+def multiBFS(G, sources, block_words = 4):
+    # BFS from every node in sources. Returns a matrix D of hop
+    # distances with D[i][j] the distance from sources[i] to node j
+    # (-1 if it is unreachable), where nodes are numbered as in toCSR(G),
+    # i.e. in the order of G["adj"]. Up to 64 * block_words sources
+    # are handled by one bit-parallel pass; more sources use several.
+    # Edges are followed in the direction they are stored, like BFS.
+    C = G if "indptr" in G else toCSR(G)
+    index = csrIndex(C)
+    n = C["n"]
+    ids = np.array([index[s] for s in sources], dtype=np.int64)
+    # a node is reached in the next layer if one of its in-neighbors
+    # is in the frontier
+    T = csrTranspose(C)
+    rev_indptr = np.asarray(T["indptr"], dtype=np.int64)
+    rev_indices = np.asarray(T["indices"], dtype=np.int64)
+    D = np.full((len(ids), n), -1, dtype=np.int32)
+    batch = 64 * block_words
+    for first in range(0, len(ids), batch):
+        block = ids[first:first+batch]
+        k = len(block)
+        nwords = (k + 63) // 64
+        pos = np.arange(k)
+        frontier = np.zeros((n, nwords), dtype=np.uint64)
+        np.bitwise_or.at(frontier, (block, pos >> 6), np.left_shift(np.uint64(1), (pos & 63).astype(np.uint64)))
+        visited = frontier.copy()
+        D[first + pos, block] = 0
+        layer = 0
+        while True:
+            layer += 1
+            frontier = neighborBits(frontier, rev_indptr, rev_indices) & ~visited
+            rows = np.flatnonzero(frontier.any(axis=1))
+            if len(rows) == 0:
+                break
+            visited[rows] |= frontier[rows]
+            # record the layer for the (node, source) bits just set
+            node, src = np.nonzero(unpackBits(frontier[rows], k))
+            D[first + src, rows[node]] = layer
+    return D
+
+
+############################################################
+# Topological sort and strongly connected components
+############################################################
+
+def topologicalSort(G):
+    # Returns the nodes of the directed acyclic graph G in an order
+    # where every edge goes from an earlier node to a later one (reverse
+    # DFS finishing order). Raises ValueError if G has a cycle.
+    C = G if "indptr" in G else toCSR(G)
+    disc, fin, par, preorder, postorder = csrDFSOrder(C)
+    # G is acyclic iff every edge (u,v) has v finished before u
+    heads = np.repeat(np.arange(C["n"]), np.diff(C["indptr"]))
+    if np.any(fin[C["indices"]] >= fin[heads]):
+        raise ValueError("The graph has a cycle, so it has no topological order.")
+    nodes = C["nodes"]
+    return nodes[postorder[::-1]].tolist()
+
+def csrSCC(C):
+    # Kosaraju's algorithm on a CSR graph: a DFS of C gives the
+    # finishing order, and a DFS of the transpose taking roots in
+    # reverse finishing order finds one component per tree. Returns an
+    # array with the component number of each node; components are
+    # numbered in topological order of the graph of components (edges
+    # only go from lower to higher numbers).
+    postorder = csrDFSOrder(C)[4]
+    disc, fin, par, preorder, _ = csrDFSOrder(csrTranspose(C), roots = postorder[::-1])
+    labels = np.empty(C["n"], dtype=np.int64)
+    labels[preorder] = np.cumsum(par[preorder] < 0) - 1 # trees are contiguous in preorder
+    return labels
+
+def SCC(G):
+    # Returns the strongly connected components of G as lists of nodes,
+    # in topological order (see csrSCC).
+    C = G if "indptr" in G else toCSR(G)
+    labels = csrSCC(C).tolist()
+    components = [[] for i in range(max(labels, default = -1) + 1)]
+    for u, label in zip(C["nodes"].tolist(), labels):
+        components[label].append(u)
+    return components
+
+def cyclicComponents(G):
+    # Every cycle of G lies inside one strongly connected component, so
+    # cycle searches only need to look at the components that have one:
+    # those with more than one node, or a single node with a self loop.
+    # Returns these components as separate graphs in the dictionary
+    # representation (keeping the order of G["adj"] and only the edges
+    # inside each component), in topological order.
+    # If G is strongly connected, it is returned as is. Otherwise the
+    # components are new graphs, which together take up to as much
+    # memory as G; a CSR copy of G also exists while they are built.
+    C = toCSR(G)
+    labels = csrSCC(C).tolist()
+    nodes = C["nodes"].tolist()
+    if len(nodes) > 0 and max(labels) == 0: # a single component
+        u = nodes[0]
+        return [G] if len(nodes) > 1 or u in G["adj"][u] else []
+    label = dict(zip(nodes, labels))
+    sizes = np.bincount(labels, minlength = max(labels, default = -1) + 1)
+    components = {}
+    for u in nodes:
+        c = label[u]
+        if sizes[c] == 1 and u not in G["adj"][u]:
+            continue # a single node without a self loop is acyclic
+        if c not in components:
+            components[c] = {"n": 0, "m": 0, "adj": {}}
+        H = components[c]
+        H["adj"][u] = {v: w for v, w in G["adj"][u].items() if label[v] == c}
+        H["n"] += 1
+        H["m"] += len(H["adj"][u])
+    return [components[c] for c in sorted(components)]
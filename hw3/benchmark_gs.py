@@ -0,0 +1,146 @@
+# Benchmark for the Gale-Shapley engines in stable_matching.py
+#
+# Times the proposal loop with the old free list (list.pop(0), O(N) per
+# proposal) against the deque (FIFO) and stack (LIFO) free lists, and
+# the vectorized round engine, on the N=1000 inputs and on generated
+# preferences of each size given (there are no larger preference files
+# in inputs). Two kinds of generated preferences are used: uniformly
+# random lists, and the worst case where everybody has the same list,
+# which takes N(N+1)/2 proposals with up to N-1 free hospitals waiting.
+#
+# Every engine gets its inputs in the form it works on (lists for the
+# loops, arrays for the rounds, and the student ranks precomputed), so
+# only the matching itself is timed. Each loop engine is also shown as
+# nanoseconds per proposal. Moving the rest of the list down by one is
+# so cheap at these N that the O(N) cost of pop(0) barely shows, so a
+# second table times the free list alone, with up to 10^6 hospitals
+# waiting: there pop(0) grows linearly and the deque and stack do not.
+#
+# usage: python benchmark_gs.py [N ...]
+
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+import stable_matching as sm
+
+
+def gs_pop0(N, hospital_prefs, ranks):
+    # gs_loop as it was before, taking the next free hospital with
+    # list.pop(0); kept here only for comparison. ranks is
+    # inverse_prefs(N, student_prefs) as a list of lists
+    free_hospital = list(range(N))
+    count = N * [0]
+    current = N * [None]
+    while free_hospital:
+        hospital = free_hospital.pop(0)
+        student = hospital_prefs[hospital][count[hospital]]
+        count[hospital] += 1
+        if current[student] is None:
+            current[student] = hospital
+        elif ranks[student][current[student]] < ranks[student][hospital]:
+            free_hospital.append(hospital)
+        else:
+            free_hospital.append(current[student])
+            current[student] = hospital
+    return current
+
+
+def free_list_cost(N, ops=20000):
+    # nanoseconds per take-and-put-back on a free list of N hospitals,
+    # for each of the three free lists
+    costs = []
+    for kind in ["pop(0)", "fifo", "lifo"]:
+        if kind == "pop(0)":
+            free_hospital = list(range(N))
+            next_free = lambda: free_hospital.pop(0)
+        elif kind == "fifo":
+            free_hospital = deque(range(N))
+            next_free = free_hospital.popleft
+        else:
+            free_hospital = list(range(N))
+            next_free = free_hospital.pop
+        start = time.perf_counter()
+        for i in range(ops):
+            free_hospital.append(next_free())
+        costs.append(1e9 * (time.perf_counter() - start) / ops)
+    return costs
+
+
+def random_prefs(N, seed):
+    rng = np.random.default_rng(seed)
+    return np.argsort(rng.random((N, N)), axis=1).astype(sm.pref_dtype(N))
+
+
+def same_prefs(N):
+    return np.tile(np.arange(N, dtype=sm.pref_dtype(N)), (N, 1))
+
+
+def cases(sizes):
+    for N in sizes:
+        if N == 1000:
+            n, h, s = sm.read_prefs("inputs/Q1/N1000_pref_file_1", "inputs/Q1/N1000_pref_file_2")
+            yield "inputs/Q1 N=1000", n, h, s
+        yield "random N={}".format(N), N, random_prefs(N, 1), random_prefs(N, 2)
+        yield "same lists N={}".format(N), N, same_prefs(N), same_prefs(N)
+
+
+def proposals(N, hospital_prefs, current):
+    # every hospital proposes down its list until it reaches its match
+    student_of = np.empty(N, dtype=np.int64)
+    student_of[np.asarray(current)] = np.arange(N)
+    hospital_ranks = sm.inverse_prefs(N, hospital_prefs)
+    return int(hospital_ranks[np.arange(N), student_of].sum()) + N
+
+
+# (name, engine, takes lists)
+ENGINES = [
+    ("pop(0)", gs_pop0, True),
+    ("fifo", lambda N, h, ranks: sm.gs_loop(N, h, None, "fifo", ranks), True),
+    ("lifo", lambda N, h, ranks: sm.gs_loop(N, h, None, "lifo", ranks), True),
+    ("rounds", lambda N, h, ranks: sm.gs_rounds(N, h, None, ranks), False),
+]
+
+
+def main(args=[]):
+    sizes = [int(x) for x in args] if args else [1000, 2000, 4000]
+    print(
+        "{:<20}{:>11}".format("case", "proposals")
+        + "".join("{:>20}".format(name) for name, engine, lists in ENGINES)
+    )
+    for name, N, h, s in cases(sizes):
+        # convert the inputs once, outside the timed region
+        ranks = sm.inverse_prefs(N, s)
+        inputs = {False: (np.asarray(h), ranks), True: (np.asarray(h).tolist(), ranks.tolist())}
+        columns = []
+        expected = None
+        for engine_name, engine, lists in ENGINES:
+            start = time.perf_counter()
+            current = engine(N, *inputs[lists])
+            elapsed = time.perf_counter() - start
+            current = list(current)
+            # every engine must find the hospital-optimal matching
+            if expected is None:
+                expected = current
+                count = proposals(N, h, current)
+            elif current != expected:
+                print("{} gave a different matching on {}".format(engine_name, name))
+            if lists:
+                columns.append("{:>8.2f}s {:>6.0f}ns/p".format(elapsed, 1e9 * elapsed / count))
+            else:
+                columns.append("{:>19.2f}s".format(elapsed))
+        print("{:<20}{:>11}".format(name, count) + "".join("{:>20}".format(c) for c in columns))
+
+    print()
+    print(
+        "{:<20}".format("free hospitals")
+        + "".join("{:>12}".format(name) for name in ["pop(0)", "fifo", "lifo"])
+    )
+    for N in [10**3, 10**4, 10**5, 10**6]:
+        print("{:<20}".format(N) + "".join("{:>8.0f}ns/p".format(c) for c in free_list_cost(N)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -9,20 +9,80 @@
 # - Mikky Steinberg
 #
 
+import os
 import sys
 import time
-
-
-def read_prefs(pref_1_filename, pref_2_filename):
+from collections import deque
+
+import numpy as np
+
+
+def pref_dtype(N):
+    # smallest integer type that holds the ids 0, ..., N-1
+    return np.int16 if N <= np.iinfo(np.int16).max + 1 else np.int32
+
+
+def read_pref_file(filename, cache=False):
+    # Reads one preference file into an N x N NumPy matrix, one row per
+    # line, parsing each line straight into the preallocated matrix so
+    # that memory stays close to N*N*2 (or 4) bytes. With cache=True the
+    # matrix is written to filename + ".prefs.npy" and memory-mapped
+    # from there, and later calls reuse that file while it is newer than
+    # filename.
+    cache_file = filename + ".prefs.npy"
+    if cache:
+        try:
+            if os.path.getmtime(cache_file) >= os.path.getmtime(filename):
+                return np.load(cache_file, mmap_mode="r")
+        except (OSError, ValueError):
+            pass  # no usable cache, parse the file again
+
+    with open(filename, "r") as f:
+        N = int(f.readline())
+        shape = (N, N)
+        if cache:
+            tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+            prefs = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=pref_dtype(N), shape=shape)
+        else:
+            prefs = np.empty(shape, dtype=pref_dtype(N))
+        try:
+            i = 0
+            for line_number, line in enumerate(f, start=2):  # line 1 holds N
+                if not line.strip():
+                    continue
+                row = np.fromstring(line, dtype=np.int64, sep=",")
+                if i >= N or len(row) != N:
+                    raise ValueError("{}: expected {} rows of {} ids".format(filename, N, N))
+                # check before storing, since the matrix may be int16
+                if row.min() < 0 or row.max() >= N:
+                    raise ValueError(
+                        "{}, line {}: ids must be between 0 and {}".format(filename, line_number, N - 1)
+                    )
+                prefs[i] = row
+                i += 1
+            if i != N:
+                raise ValueError("{}: expected {} rows of {} ids".format(filename, N, N))
+        except ValueError:
+            if cache:  # drop the partial cache file
+                del prefs
+                os.remove(tmp_file)
+            raise
+
+    if cache:
+        prefs.flush()
+        del prefs
+        os.replace(tmp_file, cache_file)
+        return np.load(cache_file, mmap_mode="r")
+    return prefs
+
+
+def read_prefs(pref_1_filename, pref_2_filename, cache=False):
     # This function reads preferences from two files
-    # and returns two-dimensional preference lists and the length of a list.
-    with open(pref_1_filename, "r") as f:
-        hospital_raw = f.read().splitlines()
-    with open(pref_2_filename, "r") as f:
-        student_raw = f.read().splitlines()
-    N = int(student_raw[0])
-    hospital_prefs = [[int(id) for id in x.split(",")] for x in hospital_raw[1:]]
-    student_prefs = [[int(id) for id in x.split(",")] for x in student_raw[1:]]
+    # and returns two-dimensional preference arrays and the length of a list.
+    # See read_pref_file for cache.
+    hospital_prefs = read_pref_file(pref_1_filename, cache)
+    student_prefs = read_pref_file(pref_2_filename, cache)
+    N = len(student_prefs)
     return N, hospital_prefs, student_prefs
 
 
@@ -30,22 +90,34 @@ def inverse_prefs(N, prefs):
     ############################################################
     # Implement inverse preference lists as described in lecture
     ############################################################
-    ranks = [
-        [0 for i in range(N)] for j in range(N)
-    ]  # initialize ranks for N * N inputs
-
-    # loop through every student
-    for i, student in enumerate(prefs):
-        # loop through their preference list...
-        for j, hospital in enumerate(student):
-            # each index in list is a hospital, its value is the hopsital's rank
-            ranks[i][hospital] = j
+    # ranks[i][x] is the position of x in row i of prefs; all of it is
+    # filled in by a single fancy-indexing assignment
+    prefs = np.asarray(prefs)
+    ranks = np.empty((N, N), dtype=pref_dtype(N))
+    ranks[np.arange(N)[:, None], prefs] = np.arange(N, dtype=ranks.dtype)
 
     return ranks  # return inverted preferences
 
 
-def run_GS(N, hospital_prefs, student_prefs, out_name):
-    free_hospital = list(range(N))
+def gs_loop(N, hospital_prefs, student_prefs, order="fifo", ranks=None):
+    # Gale-Shapley with one proposal per iteration. The next hospital to
+    # propose is the one that became free the earliest (order="fifo",
+    # a deque) or the latest (order="lifo", a list used as a stack);
+    # both take O(1) per proposal. Preference arrays are turned into
+    # lists first, since the loop indexes them one element at a time.
+    # ranks can pass in inverse_prefs(N, student_prefs), already turned
+    # into a list of lists, to skip that step.
+    # Returns the match as a list: index -> student, value -> hospital
+    if isinstance(hospital_prefs, np.ndarray):
+        hospital_prefs = hospital_prefs.tolist()
+    if order == "fifo":
+        free_hospital = deque(range(N))
+        next_free = free_hospital.popleft
+    elif order == "lifo":
+        free_hospital = list(range(N - 1, -1, -1))  # hospital 0 on top
+        next_free = free_hospital.pop
+    else:
+        raise ValueError("Unknown order: {}".format(order))
     count = N * [
         0
     ]  # stores a pointer to each hospital's next unproposed student, going from the left of hospital's preference list
@@ -54,14 +126,16 @@ def run_GS(N, hospital_prefs, student_prefs, out_name):
     ]  # stores current assignment; index -> student, value -> hospital
 
     # inverse student preference array
-    student_prefs = inverse_prefs(N, student_prefs)
+    if ranks is None:
+        ranks = inverse_prefs(N, student_prefs).tolist()
+    student_prefs = ranks
 
     # algorithm - Hospital giving offer to student
     while free_hospital:  # returns True if list is nonempty
         # print('--------')
         # print('current:', current)
         # print('free hospital', free_hospital)
-        hospital = free_hospital.pop(0)
+        hospital = next_free()
         student = hospital_prefs[hospital][count[hospital]]
         # print(hospital, 'proposing to', student)
         count[hospital] += 1
@@ -80,10 +154,67 @@ def run_GS(N, hospital_prefs, student_prefs, out_name):
                 # print('student prefers', hospital)
                 free_hospital.append(current[student])
                 current[student] = hospital
+    return current
+
+
+def gs_rounds(N, hospital_prefs, student_prefs, ranks=None):
+    # Gale-Shapley in rounds: in each round every free hospital proposes
+    # to the next student on its list at once, and each student keeps
+    # the best of its new offers and its current hospital. Hospital-
+    # proposing Gale-Shapley ends in the hospital-optimal matching
+    # whatever the order of the proposals, so this gives the same match
+    # as gs_loop. ranks can pass in inverse_prefs(N, student_prefs).
+    # Returns the match as an array: index -> student, value -> hospital
+    hospital_prefs = np.asarray(hospital_prefs)
+    if ranks is None:
+        ranks = inverse_prefs(N, student_prefs)  # ranks[student][hospital]
+
+    count = np.zeros(N, dtype=np.int64)  # next student on each hospital's list
+    current = np.full(N, -1, dtype=np.int64)  # -1 means the student is free
+    best = np.full(N, N, dtype=np.int64)  # best rank offered to each student
+    free_hospital = np.arange(N)
+
+    while free_hospital.size > 0:
+        # every free hospital proposes to its next student
+        students = hospital_prefs[free_hospital, count[free_hospital]]
+        count[free_hospital] += 1
+
+        # the students' current hospitals compete with the new offers
+        held = np.unique(students)
+        held = held[current[held] >= 0]
+        students = np.concatenate([students, held])
+        hospitals = np.concatenate([free_hospital, current[held]])
+
+        # each student keeps the offer it ranks best (ranks are distinct)
+        offer_ranks = ranks[students, hospitals]
+        np.minimum.at(best, students, offer_ranks)
+        kept = offer_ranks == best[students]
+        current[students[kept]] = hospitals[kept]
+        best[students] = N
+
+        # the rejected hospitals are free for the next round
+        free_hospital = hospitals[~kept]
+    return current
+
+
+def run_GS(N, hospital_prefs, student_prefs, out_name=None, engine="rounds", order="fifo"):
+    # engine is "rounds" for gs_rounds or "loop" for gs_loop, which
+    # takes the free hospitals in the given order. Writes the matches to
+    # out_name if it is given, and returns them as an array:
+    # index -> student, value -> hospital
+    if engine == "rounds":
+        current = gs_rounds(N, hospital_prefs, student_prefs)
+    elif engine == "loop":
+        current = np.array(gs_loop(N, hospital_prefs, student_prefs, order))
+    else:
+        raise ValueError("Unknown engine: {}".format(engine))
+
     # write out matches
-    with open(out_name, "w") as f:
-        for student, hospital in enumerate(current):
-            f.write(str(hospital) + "," + str(student) + "\n")
+    if out_name is not None:
+        with open(out_name, "w") as f:
+            for student, hospital in enumerate(current.tolist()):
+                f.write(str(hospital) + "," + str(student) + "\n")
+    return current
 
 
 ############################################################
@@ -91,53 +222,52 @@ def run_GS(N, hospital_prefs, student_prefs, out_name):
 ############################################################
 
 
-def check_stable(N, hospital_prefs, student_prefs, match_file):
-    # Implement checking of stable matches from output
-
-    # inverse student and hospital preference lists
-    inverse_student_prefs = inverse_prefs(N, student_prefs)
-    inverse_hospital_prefs = inverse_prefs(N, hospital_prefs)
-
-    # get pairings from match_file
-    f = open(match_file, "r")
-    pairings = f.readlines()
+def read_matching(N, match_file):
+    # Reads a matching file with one "hospital,student" line per pair.
+    # Returns an array: index -> hospital, value -> student
+    with open(match_file, "r") as f:
+        pairs = np.fromstring(f.read().replace(",", " "), dtype=np.int64, sep=" ").reshape(-1, 2)
+    student_of = np.full(N, -1, dtype=np.int64)
+    student_of[pairs[:, 0]] = pairs[:, 1]
+    if len(pairs) != N or (student_of < 0).any() or len(np.unique(pairs[:, 1])) != N:
+        raise ValueError("{} is not a perfect matching of size {}".format(match_file, N))
+    return student_of
+
+
+def blocking_pairs(N, hospital_prefs, student_prefs, student_of, block=1024):
+    # Returns every blocking pair of the matching student_of (index ->
+    # hospital, value -> student) as an array of (hospital, student)
+    # rows: the pairs where each one prefers the other to its match.
+    # The pairs are found from boolean masks built for block hospitals
+    # at a time, so memory stays at O(block * N).
+    hospital_ranks = inverse_prefs(N, hospital_prefs)  # [hospital][student]
+    student_ranks = inverse_prefs(N, student_prefs)  # [student][hospital]
+    student_of = np.asarray(student_of)
+    hospital_of = np.empty(N, dtype=np.int64)
+    hospital_of[student_of] = np.arange(N)
+
+    # rank of each one's own match
+    hospital_match_rank = hospital_ranks[np.arange(N), student_of]
+    student_match_rank = student_ranks[np.arange(N), hospital_of]
+
+    found = []
+    for first in range(0, N, block):
+        hospitals = np.arange(first, min(first + block, N))
+        # [h, s]: h prefers s to its match, and s prefers h to its match
+        hospital_prefers = hospital_ranks[hospitals] < hospital_match_rank[hospitals, None]
+        student_prefers = student_ranks[:, hospitals].T < student_match_rank[None, :]
+        h, s = np.nonzero(hospital_prefers & student_prefers)
+        found.append(np.stack([hospitals[h], s], axis=1))
+    return np.concatenate(found)
 
-    # create 2D array in the form of  [[hospital, student] ... [hospital, student]]
-    pairings = [[int(x) for x in pair.strip().split(",")] for pair in pairings]
 
-    # create hash table to keep track of hospital's current student assignment
-    hospital_to_student = {pair[0]: pair[1] for pair in pairings}
-
-    # iterate through all pairings
-    for pair in pairings:
-        hospital = pair[0]  # first item in pair is hospital
-        student = pair[1]  # second item in pair is student
-
-        # find the ranking of the hospital according to the student
-        hospital_rank = inverse_student_prefs[student][hospital]
-
-        # get all hospitals student prefers to the current hospital
-        student_preferred_hospitals = student_prefs[student][:hospital_rank]
-
-        # for each preferred hospital...
-        for preferred_hospital in student_preferred_hospitals:
-            # get the wishful student's rank
-            student_rank = inverse_hospital_prefs[preferred_hospital][student]
-
-            # get current pairing of the preferred hospital
-            current_student = hospital_to_student[preferred_hospital]
-
-            # get the rank of the current student
-            current_student_rank = inverse_hospital_prefs[preferred_hospital][
-                current_student
-            ]
-
-            # if they prefer the student we're checking to their current assignment...
-            if student_rank < current_student_rank:
-                print(0)  # it's unstable, print 0 and return
-                return
-
-    print(1)  # all checks passed, it's stable
+def check_stable(N, hospital_prefs, student_prefs, match_file):
+    # Implement checking of stable matches from output
+    # Prints 1 if the matching in match_file is stable and 0 if not, and
+    # returns its blocking pairs (see blocking_pairs).
+    pairs = blocking_pairs(N, hospital_prefs, student_prefs, read_matching(N, match_file))
+    print(0 if len(pairs) > 0 else 1)
+    return pairs
 
 
 ############################################################
@@ -145,30 +275,74 @@ def check_stable(N, hospital_prefs, student_prefs, match_file):
 ############################################################
 
 
-def check_unique(N, hospital_prefs, student_prefs):
+def exposed_rotation(N, hospital_prefs, student_prefs, hospital_of, block=1024):
+    # Checks whether the hospital-optimal matching hospital_of (index ->
+    # student, value -> hospital) is also student-optimal, without a
+    # second Gale-Shapley run. For each hospital h let next[h] be the
+    # hospital matched to the first student after h's own on h's list
+    # who prefers h to that hospital. The students can all do better in
+    # another stable matching iff these pointers contain a cycle (a
+    # rotation exposed in the matching, see Gusfield and Irving, "The
+    # Stable Marriage Problem", 1989), and that is the only way for the
+    # student-optimal matching to differ. Returns the hospitals on one
+    # such cycle, or [] if there is none, i.e. the matching is unique.
+    hospital_prefs = np.asarray(hospital_prefs)
+    student_ranks = inverse_prefs(N, student_prefs)  # [student][hospital]
+    hospital_of = np.asarray(hospital_of)
+    student_match_rank = student_ranks[np.arange(N), hospital_of]
+
+    nxt = np.full(N, -1, dtype=np.int64)
+    for first in range(0, N, block):
+        hospitals = np.arange(first, min(first + block, N))
+        # [h, s]: s prefers h to its own hospital. In a stable matching
+        # these all come after h's own match on h's list
+        prefers = student_ranks[:, hospitals].T < student_match_rank[None, :]
+        # the same, in the order of each hospital's list
+        in_order = np.take_along_axis(prefers, hospital_prefs[hospitals].astype(np.intp), axis=1)
+        pos = in_order.argmax(axis=1)
+        found = in_order[np.arange(len(hospitals)), pos]
+        s = hospital_prefs[hospitals[found], pos[found]]
+        nxt[hospitals[found]] = hospital_of[s]
+
+    # look for a cycle in the pointers
+    nxt = nxt.tolist()
+    state = [0] * N  # 0 = unvisited, 1 = on the current path, 2 = done
+    for h in range(N):
+        path = []
+        while h >= 0 and state[h] == 0:
+            state[h] = 1
+            path.append(h)
+            h = nxt[h]
+        if h >= 0 and state[h] == 1:
+            return path[path.index(h):]
+        for x in path:
+            state[x] = 2
+    return []
+
+
+def check_unique(N, hospital_prefs, student_prefs, method="rotation"):
     # Implement checking of a unique stable matching for given preferences
+    # There is a unique stable matching iff the hospital-optimal and the
+    # student-optimal matchings agree. With method="rotation" only the
+    # hospital-proposing run is done, and exposed_rotation decides; with
+    # method="both" the student-proposing run is done as well and the
+    # two matchings are compared. Prints 1 if the stable matching is
+    # unique and 0 if not, and returns True or False.
+
+    # run GS for hospital proposing: index -> student, value -> hospital
+    hospital_optimal = run_GS(N, hospital_prefs, student_prefs)
+
+    if method == "rotation":
+        unique = len(exposed_rotation(N, hospital_prefs, student_prefs, hospital_optimal)) == 0
+    elif method == "both":
+        # run GS for student proposing: index -> hospital, value -> student
+        student_optimal = run_GS(N, student_prefs, hospital_prefs)
+        unique = bool((hospital_optimal[student_optimal] == np.arange(N)).all())
+    else:
+        raise ValueError("Unknown method: {}".format(method))
 
-    # run GS for hospital and student proposing
-    run_GS(N, hospital_prefs, student_prefs, "hospital_optimal")
-    run_GS(N, student_prefs, hospital_prefs, "student_optimal")
-
-    # create arrays from hospital and student optimal pairing requests
-    hospital_optimal = [
-        h_pairing.strip().split(",") for h_pairing in open("hospital_optimal")
-    ]
-    student_optimal = [
-        s_pairing.strip().split(",") for s_pairing in open("student_optimal")
-    ]
-
-    # iterate through all student_optimal pairings
-    for student in student_optimal:
-        # if the student and hopsital pairings aren't the same, then there is no
-        # unique stable matching print 0 and return
-        if student[1] != hospital_optimal[int(student[0])][0]:
-            print(0)
-            return
-
-    print(1)  # else all pairings are the same, print 1
+    print(1 if unique else 0)
+    return unique
 
 
 ############################################################
